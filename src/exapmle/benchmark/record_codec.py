@@ -0,0 +1,30 @@
+import timeit
+
+from src.experiment.base import Experiment, Flag, ExperimentFlagType, AiModel
+from src.experiment.codec import JsonRecordCodec, MsgpackRecordCodec
+
+ITERATIONS = 100000
+
+flag = Flag(name="package-suggestion", type=ExperimentFlagType.STRING, base_value="regular",
+            ai_model=AiModel(name="model-suggestion1", version=12))
+experiment = Experiment(name="exp-suggestion1", flag_name="package-suggestion", flag_value="roaming",
+                        layer="phone-number", ai_model=AiModel(name="model-suggestion1", version=12), share=0.25)
+
+
+def benchmark(codec):
+    encoded_flag = codec.encode_flag(flag)
+    encoded_experiment = codec.encode_experiment(experiment)
+    results = {
+        'encode_flag': timeit.timeit(lambda: codec.encode_flag(flag), number=ITERATIONS),
+        'decode_flag': timeit.timeit(lambda: codec.decode_flag(encoded_flag), number=ITERATIONS),
+        'encode_experiment': timeit.timeit(lambda: codec.encode_experiment(experiment), number=ITERATIONS),
+        'decode_experiment': timeit.timeit(lambda: codec.decode_experiment(encoded_experiment), number=ITERATIONS),
+    }
+    print(f"{type(codec).__name__}: flag {len(encoded_flag)} bytes, experiment {len(encoded_experiment)} bytes")
+    for name, seconds in results.items():
+        print(f"    {name}: {seconds / ITERATIONS * 1e6:.2f} us")
+
+
+if __name__ == '__main__':
+    benchmark(JsonRecordCodec())
+    benchmark(MsgpackRecordCodec())
@@ -13,12 +13,12 @@ class ModelFlagPackageSuggestion:
     experiments = ExperimentManager.get_experiments_by_flag_name(flag_name)
 
     @classmethod
-    def _get_data(cls, model_name: str, experiment_name: str, partition: int) -> pd.DataFrame:
-        data = ExperimentManager.load_ai_model_data(data_name=model_name,
-                                                    flag_name=cls.flag_name,
-                                                    experiment_name=experiment_name, partition=partition)
+    def _get_data(cls, model_name: str, experiment_name: str) -> pd.DataFrame:
+        data = ExperimentManager.load_ai_model_frame(data_name=model_name,
+                                                     flag_name=cls.flag_name,
+                                                     experiment_name=experiment_name, workers=2)
         print(len(data))
-        return pd.DataFrame(data)
+        return data
 
     @abstractmethod
     def validate(self):
@@ -44,7 +44,7 @@ class ModelFlagPackageSuggestion1(ModelFlagPackageSuggestion):
         if not self.validate():
             return
 
-        sales = self._get_data(self.model_name, self.experiment.name, partition=0)
+        sales = self._get_data(self.model_name, self.experiment.name)
         users = mock_data_generator.get_users()
         packages = mock_data_generator.get_packages()
         # Combining datasets
@@ -84,7 +84,7 @@ class ModelFlagPackageSuggestion2(ModelFlagPackageSuggestion):
         if not self.validate():
             return
 
-        sales = self._get_data(self.model_name, self.experiment.name, partition=1)
+        sales = self._get_data(self.model_name, self.experiment.name)
         users = mock_data_generator.get_users()
         packages = mock_data_generator.get_packages()
         # Combining datasets
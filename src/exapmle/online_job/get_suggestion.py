@@ -6,8 +6,10 @@ from sklearn.preprocessing import LabelEncoder
 
 from exapmle.config import mock_data_generator
 from registry.model.base import ExperimentModelSingleton
+from src.experiment.config import REDIS_CLIENT
 from src.experiment.experiment_manager import ExperimentManager
-from src.registry.model.model_loader.scheduler import ModelLoader
+from src.registry.model.model_loader.event_driven import EventDrivenModelLoader
+from src.registry.model.model_loader.notifier import RedisModelVersionNotifier
 from src.registry.model.mongoDB.connector import MongoDBConnector
 from src.registry.model.mongoDB.model import MongoDBModelRegistry
 
@@ -18,7 +20,7 @@ reg = MongoDBModelRegistry(MongoDBConnector('localhost', 27017, 'mongoadmin', 's
 # m = reg.load('modelx', 'exp1', q)
 # print(m)
 
-ml = ModelLoader(reg, 10)
+ml = EventDrivenModelLoader(reg, RedisModelVersionNotifier(REDIS_CLIENT))
 ml.add_scheduler('model-suggestion1', "package-suggestion", 'exp-suggestion1')
 ml.add_scheduler('model-suggestion2', "package-suggestion", 'exp-suggestion2')
 ml.add_scheduler('model-suggestion1', "package-suggestion")
@@ -46,16 +48,14 @@ class GetPackageSuggestionAiModelData:
     flag_layer: str = "phone-number"
 
     def __init__(self):
-        evaluated_users = [ExperimentManager.evaluate(self.flag_name, self.flag_layer, user['phone_number']) for user
-                           in
-                           self.users.to_dict()]
+        evaluated_users = ExperimentManager.evaluate_many(self.flag_name, self.flag_layer, self.users['phone_number'])
         print(evaluated_users)
 
     @classmethod
     def get_suggestion(cls):
-        for user in cls.users.to_dict('records'):
-            flag_value, experiment_name = ExperimentManager.evaluate(cls.flag_name, cls.flag_layer,
-                                                                     user['phone_number'])
+        flag_values, experiment_names = ExperimentManager.evaluate_many(cls.flag_name, cls.flag_layer,
+                                                                        cls.users['phone_number'])
+        for user, flag_value, experiment_name in zip(cls.users.to_dict('records'), flag_values, experiment_names):
             print(user['phone_number'], flag_value, experiment_name)
             test_ai_model = ExperimentManager.get_ai_model(flag_name=cls.flag_name, experiment_name=experiment_name)
             ai_model = ExperimentModelSingleton.get_instance(experiment_name or cls.flag_name)
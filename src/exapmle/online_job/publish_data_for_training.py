@@ -2,8 +2,6 @@ import json
 
 from src.exapmle.config import mock_data_generator
 from src.experiment.experiment_manager import ExperimentManager
-from kafka import KafkaAdminClient
-from kafka.admin.new_partitions import NewPartitions
 
 
 class PublishPackageSuggestionAiModelData:
@@ -14,24 +12,22 @@ class PublishPackageSuggestionAiModelData:
     def publish_exp_suggestion1_data(cls):
         experiment_name = "exp-suggestion1"
         model_name = "model-suggestion1"
-        for sale in cls.sales.to_dict('records'):
-            print("publish_exp_suggestion1_data")
-            ExperimentManager.publish_ai_model_data(data=json.dumps(sale), data_name=model_name,
-                                                    flag_name=cls.flag_name,
-                                                    experiment_name=experiment_name,
-                                                    partition=0)
+        count = ExperimentManager.publish_many_ai_model_data(
+            data=(json.dumps(sale) for sale in cls.sales.to_dict('records')), data_name=model_name,
+            flag_name=cls.flag_name, experiment_name=experiment_name)
+        ExperimentManager.flush_ai_model_data()
+        print("publish_exp_suggestion1_data", count)
 
     @classmethod
     def publish_exp_suggestion2_data(cls):
         experiment_name = "exp-suggestion2"
         model_name = "model-suggestion2"
 
-        for sale in cls.sales.to_dict('records'):
-            print("publish_exp_suggestion2_data")
-            ExperimentManager.publish_ai_model_data(data=json.dumps(sale), data_name=model_name,
-                                                    flag_name=cls.flag_name,
-                                                    experiment_name=experiment_name,
-                                                    partition=1)
+        count = ExperimentManager.publish_many_ai_model_data(
+            data=(json.dumps(sale) for sale in cls.sales.to_dict('records')), data_name=model_name,
+            flag_name=cls.flag_name, experiment_name=experiment_name)
+        ExperimentManager.flush_ai_model_data()
+        print("publish_exp_suggestion2_data", count)
 
 
 PublishPackageSuggestionAiModelData.publish_exp_suggestion1_data()
@@ -0,0 +1,116 @@
+import threading
+from bisect import bisect_right
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from cachetools import LRUCache
+
+from src.experiment.base import Experiment, FrozenExperiment
+from src.experiment.config import ASSIGNMENT_TABLES_CACHE_SIZE
+
+
+@dataclass(frozen=True)
+class LayerAssignmentTable:
+    '''
+    boundaries[i] is the first bucket after the buckets covered by experiments[0..i], sorted ascending
+    '''
+    boundaries: Tuple[int, ...]
+    experiments: Tuple[FrozenExperiment, ...]
+
+    def lookup(self, bucket: int) -> Optional[FrozenExperiment]:
+        index = bisect_right(self.boundaries, bucket)
+        if index < len(self.experiments):
+            return self.experiments[index]
+        return None
+
+    def lookup_many(self, buckets: np.ndarray) -> np.ndarray:
+        """
+        Vectorized `lookup`, returns experiment indexes where len(experiments) means not assigned.
+        """
+        return np.searchsorted(np.asarray(self.boundaries, dtype=np.int64), buckets, side='right')
+
+
+@dataclass(frozen=True)
+class FlagAssignmentTable:
+    flag_name: str
+    resolution: int
+    layers: Dict[str, LayerAssignmentTable]
+
+    @classmethod
+    def compile(cls, flag_name: str, experiments: List[Experiment], resolution: int) -> 'FlagAssignmentTable':
+        """
+        Build the per-layer cumulative share tables of a flag, experiments are ordered by flag value.
+        """
+        experiments_by_layer: Dict[str, List[FrozenExperiment]] = {}
+        for experiment in sorted(experiments, key=lambda x: (x.flag_value, x.name)):
+            experiments_by_layer.setdefault(experiment.layer, []).append(experiment.freeze())
+
+        layers = {}
+        for layer, layer_experiments in experiments_by_layer.items():
+            boundaries = []
+            cumulative_share = 0
+            for experiment in layer_experiments:
+                cumulative_share += experiment.share
+                boundaries.append(round(cumulative_share * resolution))
+            layers[layer] = LayerAssignmentTable(boundaries=tuple(boundaries), experiments=tuple(layer_experiments))
+        return cls(flag_name=flag_name, resolution=resolution, layers=layers)
+
+    def lookup(self, layer: str, bucket: int) -> Optional[FrozenExperiment]:
+        layer_table = self.layers.get(layer)
+        if layer_table is None:
+            return None
+        return layer_table.lookup(bucket)
+
+    def lookup_many(self, layer: str, buckets: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Vectorized `lookup`, returns parallel object arrays of flag values and experiment names
+        and the mask of the buckets assigned to an experiment.
+        """
+        flag_values = np.empty(len(buckets), dtype=object)
+        experiment_names = np.full(len(buckets), None, dtype=object)
+        assigned = np.zeros(len(buckets), dtype=bool)
+
+        layer_table = self.layers.get(layer)
+        if layer_table is None:
+            return flag_values, experiment_names, assigned
+
+        indexes = layer_table.lookup_many(buckets)
+        assigned = indexes < len(layer_table.experiments)
+        experiment_flag_values = np.empty(len(layer_table.experiments), dtype=object)
+        experiment_flag_values[:] = [experiment.flag_value for experiment in layer_table.experiments]
+        names = np.empty(len(layer_table.experiments), dtype=object)
+        names[:] = [experiment.name for experiment in layer_table.experiments]
+        flag_values[assigned] = experiment_flag_values[indexes[assigned]]
+        experiment_names[assigned] = names[indexes[assigned]]
+        return flag_values, experiment_names, assigned
+
+
+class AssignmentTableCache:
+    """
+    Compiled tables of the most recently used flags, rebuilt only when the flag's config version (or the
+    resolution) changes. Flags without a config version are matched by the identity of their experiment list.
+    """
+
+    def __init__(self, maxsize: int = ASSIGNMENT_TABLES_CACHE_SIZE):
+        self._tables: LRUCache = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+
+    def get(self, flag_name: str, config_version: Optional[int], experiments: List[Experiment],
+            resolution: int) -> FlagAssignmentTable:
+        with self._lock:
+            compiled = self._tables.get(flag_name)
+        if compiled is not None:
+            compiled_version, compiled_experiments, assignment_table = compiled
+            same_experiments = compiled_experiments is experiments if config_version is None \
+                else compiled_version == config_version
+            if same_experiments and assignment_table.resolution == resolution:
+                return assignment_table
+        assignment_table = FlagAssignmentTable.compile(flag_name, experiments, resolution)
+        with self._lock:
+            self._tables[flag_name] = (config_version, experiments, assignment_table)
+        return assignment_table
+
+    def invalidate(self, flag_name: str):
+        with self._lock:
+            self._tables.pop(flag_name, None)
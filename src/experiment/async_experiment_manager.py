@@ -0,0 +1,157 @@
+import asyncio
+from functools import partial
+from typing import Optional, Union, List, Tuple, Dict, Callable, Awaitable, Any
+from weakref import WeakKeyDictionary
+
+import numpy as np
+from cachetools import TTLCache
+
+from src.experiment.assignment import AssignmentTableCache, FlagAssignmentTable
+from src.experiment.async_redis_connector import AsyncRedisConnector
+from src.experiment.base import Experiment, Flag
+from src.experiment.bucketing import BucketingEngine, Fnv1aBucketingEngine
+from src.experiment.config import REFRESH_EXPERIMENT_INTERVAL, EXPERIMENTS_CACHE_SIZE
+from src.experiment.exception import ExperimentNotFound, FlagNotFound
+from src.experiment.experiment_manager import ExperimentManager
+from src.registry.exception import ModelNotFound
+from src.registry.model.base import ModelRegistryInterface, ExperimentModel
+from src.registry.model.model_cache import ModelCache
+
+
+class AsyncExperimentManager:
+    """
+    asyncio counterpart of ExperimentManager for ASGI services, reads never block the event loop.
+    Concurrent requests for the same flag share one Redis fetch.
+    """
+    _redis_connector: AsyncRedisConnector
+    _model_registry: ModelRegistryInterface
+    _bucketing_engine: BucketingEngine = Fnv1aBucketingEngine()
+    _model_cache: ModelCache = ModelCache()
+    _assignment_tables = AssignmentTableCache()
+    _experiments_cache = TTLCache(maxsize=EXPERIMENTS_CACHE_SIZE, ttl=REFRESH_EXPERIMENT_INTERVAL)
+    # Futures belong to the loop that created them, so the in-flight fetches are kept per event loop
+    _in_flight: 'WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple[str, ...], asyncio.Future]]' = \
+        WeakKeyDictionary()
+
+    @classmethod
+    def initialise(cls, model_registry: ModelRegistryInterface, redis_connector: AsyncRedisConnector,
+                   bucketing_engine: Optional[BucketingEngine] = None, model_cache: Optional[ModelCache] = None):
+        cls._model_registry = model_registry
+        cls._redis_connector = redis_connector
+        if bucketing_engine is not None:
+            cls._bucketing_engine = bucketing_engine
+        if model_cache is not None:
+            cls._model_cache = model_cache
+
+    @classmethod
+    async def evaluate(cls, flag_name: str, layer: str, layer_value: Optional[Union[str, int]]):
+        assignment_table = await cls._get_assignment_table(flag_name)
+        if assignment_table is None:
+            raise ExperimentNotFound(f"Experiments with flag name:{flag_name} not found")
+        experiment = assignment_table.lookup(layer, cls._bucketing_engine.bucket(flag_name, layer, layer_value))
+        if experiment:
+            return experiment.flag_value, experiment.name
+
+        flag = await cls.get_flag(flag_name)
+        if not flag:
+            raise FlagNotFound(f"Flag with name:{flag_name} not found")
+        return flag.base_value, None
+
+    @classmethod
+    async def evaluate_many(cls, flag_name: str, layer: str, layer_values) -> Tuple[np.ndarray, np.ndarray]:
+        assignment_table = await cls._get_assignment_table(flag_name)
+        if assignment_table is None:
+            raise ExperimentNotFound(f"Experiments with flag name:{flag_name} not found")
+        buckets = cls._bucketing_engine.bucket_many(flag_name, layer, layer_values)
+
+        flag_values, experiment_names, assigned = assignment_table.lookup_many(layer, buckets)
+        if not assigned.all():
+            flag = await cls.get_flag(flag_name)
+            if not flag:
+                raise FlagNotFound(f"Flag with name:{flag_name} not found")
+            flag_values[~assigned] = flag.base_value
+        return flag_values, experiment_names
+
+    @classmethod
+    async def get_ai_model(cls, flag_name: str, experiment_name: str = None, model_name: str = None,
+                           model_version: int = None) -> Optional[ExperimentModel]:
+        flag = await cls.get_flag(flag_name)
+        if not flag:
+            raise FlagNotFound(f"Flag with name:{flag_name} not found")
+
+        experiment = None
+        if experiment_name:
+            experiment = await cls.get_experiment_by_flag_name(flag_name=flag_name, experiment_name=experiment_name)
+
+            if experiment is None:
+                raise ExperimentNotFound(f"Experiment {experiment_name} not found")
+
+        model_name, model_version = ExperimentManager._resolve_ai_model(flag, experiment, model_name, model_version)
+
+        # Model registries are synchronous, load in the default executor to keep the event loop free
+        load = partial(cls._model_cache.load, cls._model_registry, flag=flag_name, experiment=experiment_name,
+                       model_name=model_name, version=model_version)
+        try:
+            return await cls._coalesce(('ai_model', flag_name, str(experiment_name), str(model_name),
+                                        str(model_version)),
+                                       lambda: asyncio.get_running_loop().run_in_executor(None, load))
+        except ModelNotFound:
+            return None
+
+    @classmethod
+    async def get_experiments_by_flag_name(cls, flag_name: str) -> List[Experiment]:
+        return (await cls._get_versioned_experiments(flag_name))[1]
+
+    @classmethod
+    async def _get_versioned_experiments(cls, flag_name: str) -> Tuple[Optional[int], List[Experiment]]:
+        versioned_experiments = cls._experiments_cache.get(flag_name)
+        if versioned_experiments is None:
+            versioned_experiments = await cls._coalesce(('experiments', flag_name),
+                                                        partial(cls._fetch_experiments_by_flag_name, flag_name))
+        return versioned_experiments
+
+    @classmethod
+    async def _fetch_experiments_by_flag_name(cls, flag_name: str) -> Tuple[Optional[int], List[Experiment]]:
+        config_version, all_data = await cls._redis_connector.get_experiments_with_version(flag_name)
+        codec = cls._redis_connector.get_codec()
+        experiments = [codec.decode_experiment(data) for data in all_data]
+        experiments.sort(key=lambda x: x.flag_value)
+        cls._experiments_cache[flag_name] = (config_version, experiments)
+        return config_version, experiments
+
+    @classmethod
+    async def get_experiment_by_flag_name(cls, flag_name: str, experiment_name: str) -> Optional[Experiment]:
+        data = await cls._coalesce(('experiment', flag_name, experiment_name),
+                                   partial(cls._redis_connector.get_experiment_by_flag_name, flag_name,
+                                           experiment_name))
+        if data:
+            return cls._redis_connector.get_codec().decode_experiment(data)
+        return None
+
+    @classmethod
+    async def get_flag(cls, flag_name: str) -> Optional[Flag]:
+        data = await cls._coalesce(('flag', flag_name), partial(cls._redis_connector.get_flag, flag_name))
+        if data:
+            return cls._redis_connector.get_codec().decode_flag(data)
+        return None
+
+    @classmethod
+    async def _get_assignment_table(cls, flag_name: str) -> Optional[FlagAssignmentTable]:
+        config_version, experiments = await cls._get_versioned_experiments(flag_name)
+        if not experiments:
+            return None
+        return cls._assignment_tables.get(flag_name, config_version, experiments, cls._bucketing_engine.resolution)
+
+    @classmethod
+    async def _coalesce(cls, key: Tuple[str, ...], fetch: Callable[[], Awaitable[Any]]):
+        """
+        Single-flight: the first caller starts the fetch, concurrent callers with the same key await its result.
+        """
+        in_flight = cls._in_flight.setdefault(asyncio.get_running_loop(), {})
+        future = in_flight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(fetch())
+            in_flight[key] = future
+            future.add_done_callback(lambda _: in_flight.pop(key, None))
+        # Shield so a cancelled caller doesn't cancel the fetch shared with the other callers
+        return await asyncio.shield(future)
@@ -0,0 +1,56 @@
+from typing import Optional, List, Tuple
+
+import redis.asyncio
+
+from src.experiment.codec import RecordCodec, JsonRecordCodec
+from src.experiment.redis_connector import RedisConnector
+
+
+class AsyncRedisConnector:
+    """
+    Read side of RedisConnector on redis.asyncio, keys and record formats are shared with the sync connector.
+    """
+    _redis_client: redis.asyncio.Redis
+    _codec: RecordCodec = JsonRecordCodec()
+
+    @classmethod
+    def initialise(cls, redis_client: redis.asyncio.Redis, codec: Optional[RecordCodec] = None):
+        cls._redis_client = redis_client
+        if codec is not None:
+            cls._codec = codec
+        return cls
+
+    @classmethod
+    def get_codec(cls) -> RecordCodec:
+        return cls._codec
+
+    @classmethod
+    async def get_experiments_by_flag_name(cls, flag_name: str):
+        return await cls._redis_client.hvals(RedisConnector._get_flag_experiments_key(flag_name))
+
+    @classmethod
+    async def get_experiments_with_version(cls, flag_name: str) -> Tuple[Optional[int], list]:
+        async with cls._redis_client.pipeline(transaction=True) as pipeline:
+            pipeline.zscore(RedisConnector._flags_config_version_key, flag_name)
+            pipeline.hvals(RedisConnector._get_flag_experiments_key(flag_name))
+            version, experiments = await pipeline.execute()
+        return (int(version) if version is not None else None), experiments
+
+    @classmethod
+    async def get_experiment_by_flag_name(cls, flag_name: str, experiment_name: str):
+        return await cls._redis_client.hget(RedisConnector._get_flag_experiments_key(flag_name), experiment_name)
+
+    @classmethod
+    async def get_flag(cls, flag_name: str):
+        return await cls._redis_client.get(RedisConnector._get_flag_key(flag_name))
+
+    @classmethod
+    async def get_flags(cls, flag_names: List[str]) -> list:
+        if not flag_names:
+            return []
+        return await cls._redis_client.mget([RedisConnector._get_flag_key(flag_name) for flag_name in flag_names])
+
+    @classmethod
+    async def get_config_version(cls) -> int:
+        version = await cls._redis_client.get(RedisConnector._config_version_key)
+        return int(version) if version else 0
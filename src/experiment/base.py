@@ -1,5 +1,6 @@
 from dataclasses import dataclass, asdict
 from enum import Enum
+from sys import intern
 from typing import Any, Optional
 
 
@@ -11,6 +12,7 @@ class ExperimentFlagType(str, Enum):
 
 @dataclass
 class AiModel:
+    __slots__ = ('name', 'version')
     name: str
     version: int
 
@@ -29,17 +31,38 @@ class AiModel:
     def from_dict(cls, data):
         return cls(**data)
 
+    def freeze(self) -> 'FrozenAiModel':
+        return FrozenAiModel(name=self.name, version=self.version)
+
 
 @dataclass
 class Flag:
+    __slots__ = ('name', 'type', 'base_value', 'ai_model')
     name: str
     type: ExperimentFlagType
     base_value: Any
     ai_model: Optional[AiModel]
 
+    @classmethod
+    def trusted(cls, name: str, type: ExperimentFlagType, base_value: Any, ai_model: Optional[AiModel]) -> 'Flag':
+        """
+        Build a flag from data written by this package (e.g. deserialization), the name is interned.
+        """
+        flag = object.__new__(cls)
+        flag.name = intern(name)
+        flag.type = type
+        flag.base_value = base_value
+        flag.ai_model = ai_model
+        return flag
+
+    def freeze(self) -> 'FrozenFlag':
+        return FrozenFlag(name=self.name, type=self.type, base_value=self.base_value,
+                          ai_model=self.ai_model.freeze() if self.ai_model else None)
+
 
 @dataclass
 class Experiment:
+    __slots__ = ('name', 'flag_name', 'flag_value', 'layer', 'ai_model', 'share')
     name: str
     flag_name: str
     flag_value: Any
@@ -53,3 +76,72 @@ class Experiment:
     def __post_init__(self):
         if not 0 <= self.share <= 1:
             raise ValueError("Share value must be a float between 0 and 1, inclusive.")
+
+    @classmethod
+    def trusted(cls, name: str, flag_name: str, flag_value: Any, layer: str, ai_model: Optional[AiModel],
+                share: float) -> 'Experiment':
+        """
+        Build an experiment from data already validated on save, skipping __post_init__.
+        The flag and layer names are interned since they repeat across every experiment of a flag.
+        """
+        experiment = object.__new__(cls)
+        experiment.name = name
+        experiment.flag_name = intern(flag_name)
+        experiment.flag_value = flag_value
+        experiment.layer = intern(layer)
+        experiment.ai_model = ai_model
+        experiment.share = share
+        return experiment
+
+    def freeze(self) -> 'FrozenExperiment':
+        return FrozenExperiment(name=self.name, flag_name=self.flag_name, flag_value=self.flag_value,
+                                layer=self.layer, ai_model=self.ai_model.freeze() if self.ai_model else None,
+                                share=self.share)
+
+
+@dataclass(frozen=True)
+class FrozenAiModel:
+    """
+    Immutable counterpart of AiModel, held by the frozen flags and experiments.
+    """
+    __slots__ = ('name', 'version')
+    name: str
+    version: int
+
+    def thaw(self) -> AiModel:
+        return AiModel(name=self.name, version=self.version)
+
+
+@dataclass(frozen=True)
+class FrozenFlag:
+    """
+    Immutable counterpart of Flag, safe to share between threads and caches.
+    """
+    __slots__ = ('name', 'type', 'base_value', 'ai_model')
+    name: str
+    type: ExperimentFlagType
+    base_value: Any
+    ai_model: Optional[FrozenAiModel]
+
+    def thaw(self) -> Flag:
+        return Flag.trusted(name=self.name, type=self.type, base_value=self.base_value,
+                            ai_model=self.ai_model.thaw() if self.ai_model else None)
+
+
+@dataclass(frozen=True)
+class FrozenExperiment:
+    """
+    Immutable counterpart of Experiment, safe to share between threads and caches.
+    """
+    __slots__ = ('name', 'flag_name', 'flag_value', 'layer', 'ai_model', 'share')
+    name: str
+    flag_name: str
+    flag_value: Any
+    layer: str
+    ai_model: Optional[FrozenAiModel]
+    share: float
+
+    def thaw(self) -> Experiment:
+        return Experiment.trusted(name=self.name, flag_name=self.flag_name, flag_value=self.flag_value,
+                                  layer=self.layer, ai_model=self.ai_model.thaw() if self.ai_model else None,
+                                  share=self.share)
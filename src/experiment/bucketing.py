@@ -0,0 +1,117 @@
+from abc import ABC, abstractmethod
+from typing import Union, Iterable
+
+import numpy as np
+
+from src.experiment.config import BUCKET_RESOLUTION
+
+_MASK_64 = 0xFFFFFFFFFFFFFFFF
+_FNV_OFFSET_BASIS_64 = 0xCBF29CE484222325
+_FNV_PRIME_64 = 0x100000001B3
+_FMIX_CONSTANT_1 = 0xFF51AFD7ED558CCD
+_FMIX_CONSTANT_2 = 0xC4CEB9FE1A85EC53
+
+
+class BucketingEngine(ABC):
+    """
+    Maps `flag|layer|layer_value` keys to a bucket in [0, resolution), identically in every process.
+    """
+
+    def __init__(self, resolution: int = BUCKET_RESOLUTION):
+        if resolution <= 0:
+            raise ValueError("Bucket resolution must be a positive integer.")
+        self.resolution = resolution
+
+    @abstractmethod
+    def hash(self, prefix: bytes, value: bytes) -> int:
+        pass
+
+    @abstractmethod
+    def hash_many(self, prefix: bytes, values: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+        """
+        Hash a fixed width bytes (`S`) array of values, lengths holds the byte length of each value since `S`
+        arrays don't keep trailing NULs apart from the padding. Returns an uint64 array.
+        """
+        pass
+
+    @staticmethod
+    def _get_prefix(flag_name, layer) -> bytes:
+        return f"{flag_name}|{layer}|".encode('utf-8')
+
+    def bucket(self, flag_name, layer, layer_value) -> int:
+        prefix = self._get_prefix(flag_name, layer)
+        return self.hash(prefix, str(layer_value).encode('utf-8')) % self.resolution
+
+    def bucket_many(self, flag_name, layer, layer_values: Union[np.ndarray, Iterable]) -> np.ndarray:
+        """
+        Vectorized `bucket`, each layer value is stringified with `str(layer_value)` like `bucket` does.
+        """
+        values = self._to_array(layer_values)
+        if values.size == 0:
+            return np.empty(0, dtype=np.int64)
+        if values.dtype.kind in 'iuU':
+            # numpy formats integers and strings exactly like str()
+            encoded = np.char.encode(values.astype(str), 'utf-8')
+            lengths = np.char.str_len(encoded)
+        else:
+            # Floats, bools, bytes, None... differ once converted by numpy, stringify each value
+            raw_values = [str(value).encode('utf-8') for value in values]
+            lengths = np.fromiter(map(len, raw_values), dtype=np.int64, count=len(raw_values))
+            encoded = np.array(raw_values, dtype=f'S{max(int(lengths.max()), 1)}')
+        prefix = self._get_prefix(flag_name, layer)
+        hashes = self.hash_many(prefix, np.ascontiguousarray(encoded), lengths)
+        return (hashes % np.uint64(self.resolution)).astype(np.int64)
+
+    @staticmethod
+    def _to_array(layer_values: Union[np.ndarray, Iterable]) -> np.ndarray:
+        """
+        Arrays and Series keep their dtype, other iterables become object arrays so e.g. [1, 2.5] keeps the int.
+        """
+        if isinstance(layer_values, np.ndarray):
+            return layer_values.ravel()
+        if hasattr(layer_values, 'to_numpy'):
+            return np.asarray(layer_values.to_numpy()).ravel()
+        layer_values = list(layer_values)
+        return np.fromiter(layer_values, dtype=object, count=len(layer_values))
+
+
+class Fnv1aBucketingEngine(BucketingEngine):
+    """
+    64-bit FNV-1a followed by the murmur3 fmix64 finalizer to spread the low bits used by the modulo.
+    """
+
+    @staticmethod
+    def _fnv1a(state: int, data: bytes) -> int:
+        for byte in data:
+            state = ((state ^ byte) * _FNV_PRIME_64) & _MASK_64
+        return state
+
+    @staticmethod
+    def _fmix64(state: int) -> int:
+        state ^= state >> 33
+        state = (state * _FMIX_CONSTANT_1) & _MASK_64
+        state ^= state >> 33
+        state = (state * _FMIX_CONSTANT_2) & _MASK_64
+        state ^= state >> 33
+        return state
+
+    def hash(self, prefix: bytes, value: bytes) -> int:
+        return self._fmix64(self._fnv1a(self._fnv1a(_FNV_OFFSET_BASIS_64, prefix), value))
+
+    def hash_many(self, prefix: bytes, values: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+        width = values.dtype.itemsize
+        data = values.view(np.uint8).reshape(values.size, width)
+
+        prime = np.uint64(_FNV_PRIME_64)
+        states = np.full(values.size, self._fnv1a(_FNV_OFFSET_BASIS_64, prefix), dtype=np.uint64)
+        for column in range(width):
+            mixed = (states ^ data[:, column]) * prime
+            states = np.where(lengths > column, mixed, states)
+
+        shift = np.uint64(33)
+        states ^= states >> shift
+        states *= np.uint64(_FMIX_CONSTANT_1)
+        states ^= states >> shift
+        states *= np.uint64(_FMIX_CONSTANT_2)
+        states ^= states >> shift
+        return states
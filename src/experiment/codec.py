@@ -0,0 +1,125 @@
+import json
+from abc import ABC, abstractmethod
+from typing import Union
+
+from src.experiment.base import Experiment, Flag, ExperimentFlagType, AiModel
+
+try:
+    import msgpack
+except ImportError:  # msgpack is only needed for the binary codec
+    msgpack = None
+
+'''
+Binary records start with a schema version byte, JSON records always start with "{",
+so both formats can be stored side by side and every reader understands both.
+'''
+MSGPACK_SCHEMA_V1 = b'\x01'
+
+
+class RecordCodec(ABC):
+    @abstractmethod
+    def encode_flag(self, flag: Flag) -> bytes:
+        pass
+
+    @abstractmethod
+    def encode_experiment(self, experiment: Experiment) -> bytes:
+        pass
+
+    def decode_flag(self, data: Union[bytes, str]) -> Flag:
+        return decode_flag(data)
+
+    def decode_experiment(self, data: Union[bytes, str]) -> Experiment:
+        return decode_experiment(data)
+
+
+class JsonRecordCodec(RecordCodec):
+    def encode_flag(self, flag: Flag) -> bytes:
+        return json.dumps({
+            'name': flag.name,
+            'type': flag.type.value,
+            'base_value': flag.base_value,
+            'ai_model': flag.ai_model.to_dict() if flag.ai_model else None,
+        }).encode('utf-8')
+
+    def encode_experiment(self, experiment: Experiment) -> bytes:
+        return json.dumps({
+            'name': experiment.name,
+            'flag_name': experiment.flag_name,
+            'flag_value': experiment.flag_value,
+            'layer': experiment.layer,
+            'ai_model': experiment.ai_model.to_dict() if experiment.ai_model else None,
+            'share': experiment.share,
+        }).encode('utf-8')
+
+
+class MsgpackRecordCodec(RecordCodec):
+    """
+    Positional msgpack records prefixed with the schema version byte, requires a client without decode_responses.
+    """
+
+    def __init__(self):
+        if msgpack is None:
+            raise ImportError("msgpack is required for MsgpackRecordCodec")
+
+    def encode_flag(self, flag: Flag) -> bytes:
+        ai_model = flag.ai_model
+        return MSGPACK_SCHEMA_V1 + msgpack.packb([
+            flag.name,
+            flag.type.value,
+            flag.base_value,
+            ai_model.name if ai_model else None,
+            ai_model.version if ai_model else None,
+        ])
+
+    def encode_experiment(self, experiment: Experiment) -> bytes:
+        ai_model = experiment.ai_model
+        return MSGPACK_SCHEMA_V1 + msgpack.packb([
+            experiment.name,
+            experiment.flag_name,
+            experiment.flag_value,
+            experiment.layer,
+            experiment.share,
+            ai_model.name if ai_model else None,
+            ai_model.version if ai_model else None,
+        ])
+
+
+def _is_msgpack_v1(data: Union[bytes, str]) -> bool:
+    return isinstance(data, bytes) and data[:1] == MSGPACK_SCHEMA_V1
+
+
+def _unpack_msgpack_v1(data: bytes) -> list:
+    if msgpack is None:
+        raise ImportError("msgpack is required to decode binary records")
+    return msgpack.unpackb(memoryview(data)[1:])
+
+
+def decode_flag(data: Union[bytes, str]) -> Flag:
+    if _is_msgpack_v1(data):
+        name, flag_type, base_value, ai_model_name, ai_model_version = _unpack_msgpack_v1(data)
+        ai_model = AiModel(ai_model_name, ai_model_version) if ai_model_name is not None else None
+        return Flag.trusted(name=name, type=ExperimentFlagType(flag_type), base_value=base_value, ai_model=ai_model)
+
+    data = json.loads(data)
+    return Flag.trusted(name=data['name'],
+                        type=ExperimentFlagType[data['type']],
+                        base_value=data['base_value'],
+                        ai_model=AiModel.from_dict(data['ai_model']) if data.get('ai_model') else None)
+
+
+def decode_experiment(data: Union[bytes, str]) -> Experiment:
+    if _is_msgpack_v1(data):
+        name, flag_name, flag_value, layer, share, ai_model_name, ai_model_version = _unpack_msgpack_v1(data)
+        ai_model = AiModel(ai_model_name, ai_model_version) if ai_model_name is not None else None
+        return Experiment.trusted(name=name, flag_name=flag_name, flag_value=flag_value, layer=layer,
+                                  ai_model=ai_model, share=share)
+
+    data = json.loads(data)
+    return Experiment.trusted(
+        name=data['name'],
+        flag_name=data['flag_name'],
+        flag_value=data['flag_value'],
+        share=data['share'],
+        layer=data['layer'],
+        ai_model=AiModel.from_dict(data['ai_model']) if data.get('ai_model') else None
+    )
@@ -1,5 +1,16 @@
 import redis
+import redis.asyncio
 
 REFRESH_EXPERIMENT_INTERVAL = 1 * 10
+EXPERIMENTS_CACHE_SIZE = 10
+ASSIGNMENT_TABLES_CACHE_SIZE = 1024
+
+BUCKET_RESOLUTION = 10000
+
+SNAPSHOT_CHANGES_CHANNEL = "experiment_controller_changes"
+SNAPSHOT_POLL_INTERVAL = 0.1
+
+REDIS_MAX_CONNECTIONS = 50
 
 REDIS_CLIENT = redis.StrictRedis(host='localhost', port=6379)
+ASYNC_REDIS_CLIENT = redis.asyncio.StrictRedis(host='localhost', port=6379, max_connections=REDIS_MAX_CONNECTIONS)
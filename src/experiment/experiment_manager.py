@@ -1,29 +1,69 @@
-import json
-from typing import Optional, Union, List
+import threading
+from typing import Optional, Union, List, Dict, Tuple, Iterable, Iterator, Callable, TYPE_CHECKING
 
-import cachetools.func
+import numpy as np
+from cachetools import TTLCache
 
-from src.experiment.base import Experiment, Flag, ExperimentFlagType, AiModel
-from src.experiment.config import REFRESH_EXPERIMENT_INTERVAL
+from src.experiment.assignment import FlagAssignmentTable, AssignmentTableCache
+from src.experiment.base import Experiment, Flag, AiModel
+from src.experiment.bucketing import BucketingEngine, Fnv1aBucketingEngine
+from src.experiment.config import REFRESH_EXPERIMENT_INTERVAL, EXPERIMENTS_CACHE_SIZE
 from src.experiment.exception import ExperimentNotFound, FlagNotFound
 from src.experiment.redis_connector import RedisConnector
 from src.registry.data.base import DataRegisteryInterface
 from src.registry.exception import ModelNotFound
-from src.registry.model.base import ModelRegistryInterface, ExperimentModel
+from src.registry.model.base import ModelRegistryInterface, ExperimentModel, ModelVersionNotifierInterface, \
+    ModelVersionEvent
+from src.registry.model.model_cache import ModelCache
+from src.registry.model.serializer import ModelSerializerInterface
+
+if TYPE_CHECKING:
+    import pandas as pd
+    import pyarrow as pa
 
 
 class ExperimentManager:
     _redis_connector: RedisConnector
-    _experiments_with_cumulative_share = {}
+    _assignment_tables = AssignmentTableCache()
+    _experiments_cache = TTLCache(maxsize=EXPERIMENTS_CACHE_SIZE, ttl=REFRESH_EXPERIMENT_INTERVAL)
+    _experiments_cache_lock = threading.Lock()
     _model_registry: ModelRegistryInterface
     _data_registry: DataRegisteryInterface
+    _bucketing_engine: BucketingEngine = Fnv1aBucketingEngine()
+    _model_cache: ModelCache = ModelCache()
+    _model_version_notifier: Optional[ModelVersionNotifierInterface] = None
 
     @classmethod
     def initialise(cls, model_registry: ModelRegistryInterface, redis_connector: RedisConnector,
-                   data_registry: DataRegisteryInterface):
+                   data_registry: DataRegisteryInterface, bucketing_engine: Optional[BucketingEngine] = None,
+                   local_snapshot: bool = False, model_cache: Optional[ModelCache] = None,
+                   model_version_notifier: Optional[ModelVersionNotifierInterface] = None):
         cls._model_registry = model_registry
         cls._redis_connector = redis_connector
         cls._data_registry = data_registry
+        if bucketing_engine is not None:
+            cls._bucketing_engine = bucketing_engine
+        if model_cache is not None:
+            cls._model_cache = model_cache
+        cls._model_version_notifier = model_version_notifier
+        if local_snapshot:
+            # Serve flags and experiments from memory, kept fresh by Redis change notifications
+            redis_connector.enable_local_snapshot(on_change=cls._on_flag_changed)
+
+    @classmethod
+    def _on_flag_changed(cls, flag_name: str):
+        # Only the changed flag is evicted, the other flags keep their cached experiments
+        with cls._experiments_cache_lock:
+            cls._experiments_cache.pop(flag_name, None)
+        cls._assignment_tables.invalidate(flag_name)
+
+    @classmethod
+    def subscribe_changes(cls, on_change: Callable[[str], None], on_reconnect: Optional[Callable[[], None]] = None):
+        """
+        Call on_change with the name of every changed flag (flag or experiments saved or deleted), e.g. to follow
+        admin changes of an ai_model. Returns the subscription thread, stop it to unsubscribe.
+        """
+        return cls._redis_connector.subscribe_changes(on_change, on_reconnect=on_reconnect)
 
     @classmethod
     def save_experiment(cls, experiment: Experiment, need_update_model_registry: bool = True):
@@ -32,6 +72,19 @@ class ExperimentManager:
             cls._model_registry.update(model_name=experiment.ai_model.name, flag=experiment.flag_name,
                                        version=experiment.ai_model.version, experiments=[experiment.name])
 
+    @classmethod
+    def save_many(cls, flags: Optional[List[Flag]] = None, experiments: Optional[List[Experiment]] = None,
+                  need_update_model_registry: bool = True):
+        """
+        Save flags and experiments atomically in one Redis transaction, e.g. for bulk imports.
+        """
+        cls._redis_connector.save_many(flags=flags, experiments=experiments)
+        if need_update_model_registry:
+            for experiment in experiments or []:
+                if experiment.ai_model:
+                    cls._model_registry.update(model_name=experiment.ai_model.name, flag=experiment.flag_name,
+                                               version=experiment.ai_model.version, experiments=[experiment.name])
+
     @classmethod
     def delete_experiment(cls, flag_name: str, experiment_name: str):
         cls._redis_connector.delete_experiment(flag_name, experiment_name)
@@ -46,19 +99,38 @@ class ExperimentManager:
 
     @classmethod
     def evaluate(cls, flag_name: str, layer: str, layer_value: Optional[Union[str, int]]):
-        cls.get_experiments_by_flag_name(flag_name=flag_name)
-        if not cls._experiments_with_cumulative_share:
+        assignment_table = cls._get_assignment_table(flag_name)
+        if assignment_table is None:
             raise ExperimentNotFound(f"Experiments with flag name:{flag_name} not found")
         experiment_range = cls._experiment_to_range(flag_name, layer, layer_value)
-        for cumulative_share, experiment in cls._experiments_with_cumulative_share.items():
-            if experiment_range <= cumulative_share:
-                return experiment.flag_value, experiment.name
+        experiment = assignment_table.lookup(layer, experiment_range)
+        if experiment:
+            return experiment.flag_value, experiment.name
 
         flag = cls.get_flag(flag_name)
         if not flag:
             raise FlagNotFound(f"Flag with name:{flag_name} not found")
         return flag.base_value, None
 
+    @classmethod
+    def evaluate_many(cls, flag_name: str, layer: str, layer_values) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Evaluate a batch of layer values (list, numpy array or pandas Series) resolving the flag once.
+        Returns parallel object arrays of flag values and experiment names (None for the flag base value).
+        """
+        assignment_table = cls._get_assignment_table(flag_name)
+        if assignment_table is None:
+            raise ExperimentNotFound(f"Experiments with flag name:{flag_name} not found")
+        buckets = cls._bucketing_engine.bucket_many(flag_name, layer, layer_values)
+
+        flag_values, experiment_names, assigned = assignment_table.lookup_many(layer, buckets)
+        if not assigned.all():
+            flag = cls.get_flag(flag_name)
+            if not flag:
+                raise FlagNotFound(f"Flag with name:{flag_name} not found")
+            flag_values[~assigned] = flag.base_value
+        return flag_values, experiment_names
+
     @classmethod
     def get_flag_ai_models_specifications(cls, flag_name: str) -> List[AiModel]:
         try:
@@ -73,43 +145,77 @@ class ExperimentManager:
         if not flag:
             raise FlagNotFound(f"Flag with name:{flag_name} not found")
 
+        experiment = None
         if experiment_name:
             experiment = cls.get_experiment_by_flag_name(flag_name=flag_name, experiment_name=experiment_name)
 
             if experiment is None:
                 raise ExperimentNotFound(f"Experiment {experiment_name} not found")
 
-            if experiment.ai_model:
-                if model_name is None:
-                    model_name = experiment.ai_model.name
-                if model_version is None:
-                    model_version = experiment.ai_model.version
+        model_name, model_version = cls._resolve_ai_model(flag, experiment, model_name, model_version)
+
+        try:
+            return cls._model_cache.load(cls._model_registry,
+                                         flag=flag_name,
+                                         experiment=experiment_name,
+                                         model_name=model_name,
+                                         version=model_version)
+        except ModelNotFound:
+            return None
+
+    @staticmethod
+    def _resolve_ai_model(flag: Flag, experiment: Optional[Experiment], model_name: Optional[str],
+                          model_version: Optional[int]) -> Tuple[Optional[str], Optional[int]]:
+        """
+        Fill the missing model name/version from the experiment first, then from the flag.
+        """
+        if experiment and experiment.ai_model:
+            if model_name is None:
+                model_name = experiment.ai_model.name
+            if model_version is None:
+                model_version = experiment.ai_model.version
 
         if flag.ai_model:
             if model_name is None:
                 model_name = flag.ai_model.name
             if model_version is None:
                 model_version = flag.ai_model.version
-
-        try:
-            return cls._model_registry.load(flag=flag_name,
-                                            experiment=experiment_name,
-                                            model_name=model_name,
-                                            version=model_version)
-        except ModelNotFound:
-            return None
+        return model_name, model_version
 
     @classmethod
-    @cachetools.func.ttl_cache(maxsize=10, ttl=REFRESH_EXPERIMENT_INTERVAL)
     def get_experiments_by_flag_name(cls, flag_name: str) -> List[Experiment]:
-        all_data = cls._redis_connector.get_experiments_by_flag_name(flag_name)
+        return cls._get_versioned_experiments(flag_name)[1]
+
+    @classmethod
+    def _get_versioned_experiments(cls, flag_name: str) -> Tuple[Optional[int], List[Experiment]]:
+        with cls._experiments_cache_lock:
+            versioned_experiments = cls._experiments_cache.get(flag_name)
+        if versioned_experiments is not None:
+            return versioned_experiments
+
+        config_version, all_data = cls._redis_connector.get_experiments_with_version(flag_name)
         deserialize_experiments = [cls._deserialize_experiment(data) for data in all_data]
         deserialize_experiments.sort(key=lambda x: x.flag_value)
-        cumulative_share = 0
-        for deserialize_experiment in deserialize_experiments:
-            cumulative_share += deserialize_experiment.share
-            cls._experiments_with_cumulative_share[cumulative_share] = deserialize_experiment
-        return deserialize_experiments
+        versioned_experiments = (config_version, deserialize_experiments)
+        with cls._experiments_cache_lock:
+            cls._experiments_cache[flag_name] = versioned_experiments
+        return versioned_experiments
+
+    @classmethod
+    def _get_assignment_table(cls, flag_name: str) -> Optional[FlagAssignmentTable]:
+        """
+        The flag's compiled table, reused while the flag's config version is unchanged. None without experiments.
+        """
+        config_version, experiments = cls._get_versioned_experiments(flag_name)
+        if not experiments:
+            return None
+        return cls._assignment_tables.get(flag_name, config_version, experiments, cls._bucketing_engine.resolution)
+
+    @classmethod
+    def get_experiments_for_flags(cls, flag_names: List[str]) -> Dict[str, List[Experiment]]:
+        all_data = cls._redis_connector.get_experiments_for_flags(flag_names)
+        return {flag_name: [cls._deserialize_experiment(data) for data in flag_data]
+                for flag_name, flag_data in zip(flag_names, all_data)}
 
     @classmethod
     def get_experiment_by_flag_name(cls, flag_name: str, experiment_name: str) -> Optional[Experiment]:
@@ -119,7 +225,7 @@ class ExperimentManager:
 
     @classmethod
     def register_ai_model(cls, model, model_name: str, flag_name: str, experiment_name: str,
-                          version: Optional[int] = None):
+                          version: Optional[int] = None, serializer: Optional[ModelSerializerInterface] = None):
         experiment = cls.get_experiment_by_flag_name(flag_name=flag_name, experiment_name=experiment_name)
 
         if experiment is None:
@@ -129,9 +235,15 @@ class ExperimentManager:
                                                                 model_name=model_name,
                                                                 flag=flag_name,
                                                                 experiments=[experiment_name],
-                                                                version=version)
+                                                                version=version,
+                                                                serializer=serializer)
         experiment.ai_model = AiModel(name=model_name, version=registered_model_version)
         cls.save_experiment(experiment, need_update_model_registry=False)
+        cls._model_cache.invalidate_latest_versions(flag_name)
+        if cls._model_version_notifier is not None:
+            cls._model_version_notifier.publish(ModelVersionEvent(flag=flag_name, model_name=model_name,
+                                                                  version=registered_model_version,
+                                                                  experiments=[experiment_name]))
 
     @classmethod
     def load_ai_model_data(cls, data_name: str, flag_name: str, experiment_name: str, **kwargs):
@@ -143,6 +255,32 @@ class ExperimentManager:
 
         return cls._data_registry.load(data_name=data_name, experiment=experiment_name, **kwargs)
 
+    @classmethod
+    def load_ai_model_frame(cls, data_name: str, flag_name: str, experiment_name: str,
+                            schema: Optional['pa.Schema'] = None, **kwargs) -> 'pd.DataFrame':
+        """
+        Load the experiment's data as a DataFrame decoded column-wise, schema is an optional pyarrow.Schema.
+        """
+        experiment = cls.get_experiment_by_flag_name(flag_name=flag_name, experiment_name=experiment_name)
+
+        if experiment is None:
+            raise ExperimentNotFound(f"Experiment {experiment_name} not found")
+
+        return cls._data_registry.load_frame(data_name=data_name, experiment=experiment_name, schema=schema,
+                                             **kwargs)
+
+    @classmethod
+    def iter_load_ai_model_data(cls, data_name: str, flag_name: str, experiment_name: str, **kwargs) -> Iterator[List]:
+        """
+        Stream the experiment's data in micro-batches, see the data registry's iter_load for the options.
+        """
+        experiment = cls.get_experiment_by_flag_name(flag_name=flag_name, experiment_name=experiment_name)
+
+        if experiment is None:
+            raise ExperimentNotFound(f"Experiment {experiment_name} not found")
+
+        return cls._data_registry.iter_load(data_name=data_name, experiment=experiment_name, **kwargs)
+
     @classmethod
     def publish_ai_model_data(cls, data, data_name: str, flag_name: str, experiment_name: str,
                               version: Optional[int] = None, **kwargs):
@@ -154,6 +292,24 @@ class ExperimentManager:
 
         return cls._data_registry.publish(data=data, data_name=data_name, experiment=experiment_name, **kwargs)
 
+    @classmethod
+    def publish_many_ai_model_data(cls, data: Iterable, data_name: str, flag_name: str, experiment_name: str,
+                                   version: Optional[int] = None, **kwargs) -> int:
+        """
+        Publish a batch of records resolving the experiment once, call flush_ai_model_data to wait for delivery.
+        """
+        experiment = cls.get_experiment_by_flag_name(flag_name=flag_name, experiment_name=experiment_name)
+
+        if experiment is None:
+            raise ExperimentNotFound(f"Experiment {experiment_name} not found")
+
+        return cls._data_registry.publish_many(data=data, data_name=data_name, experiment=experiment_name,
+                                               version=version, **kwargs)
+
+    @classmethod
+    def flush_ai_model_data(cls, timeout: Optional[float] = None):
+        cls._data_registry.flush(timeout=timeout)
+
     @classmethod
     def get_flag(cls, flag_name: str) -> Optional[Flag]:
         data = cls._redis_connector.get_flag(flag_name)
@@ -162,42 +318,34 @@ class ExperimentManager:
         return None
 
     @classmethod
-    def _deserialize_experiment(cls, item: str) -> Experiment:
-        data = json.loads(item)
-        experiment = Experiment(
-            name=data['name'],
-            flag_name=data['flag_name'],
-            flag_value=data['flag_value'],
-            share=data['share'],
-            layer=data['layer'],
-            ai_model=None
-
-        )
-        if data.get('ai_model'):
-            experiment.ai_model = AiModel.from_dict(data['ai_model'])
-        return experiment
+    def get_flags(cls, flag_names: List[str]) -> Dict[str, Optional[Flag]]:
+        all_data = cls._redis_connector.get_flags(flag_names)
+        return {flag_name: cls._deserialize_flag(data) if data else None
+                for flag_name, data in zip(flag_names, all_data)}
 
     @classmethod
-    def _experiment_to_range(cls, flag_name, layer, layer_value):
-        flag_name_str = str(flag_name)
-        layer_str = str(layer)
-        layer_value_str = str(layer_value)
-
-        composite_key = f"{flag_name_str}|{layer_str}|{layer_value_str}"
+    def get_config_version(cls) -> int:
+        return cls._redis_connector.get_config_version()
 
-        hash_value = hash(composite_key)
+    @classmethod
+    def get_changed_flags(cls, since_version: int) -> Tuple[int, Dict[str, int]]:
+        """
+        Cheap change detection: returns the current config version and only the flags (with their versions)
+        changed after since_version. Pass the returned version on the next call.
+        """
+        return cls._redis_connector.get_changed_flags(since_version)
 
-        mapped_value = abs(hash_value) % 101
+    @classmethod
+    def _deserialize_experiment(cls, item: Union[bytes, str]) -> Experiment:
+        return cls._redis_connector.get_codec().decode_experiment(item)
 
-        return mapped_value / 100
+    @classmethod
+    def _experiment_to_range(cls, flag_name, layer, layer_value) -> int:
+        """
+        Map the layer value to a bucket in [0, resolution), stable across processes and hosts.
+        """
+        return cls._bucketing_engine.bucket(flag_name, layer, layer_value)
 
     @classmethod
-    def _deserialize_flag(cls, item: str) -> Flag:
-        data = json.loads(item)
-        flag = Flag(name=data['name'],
-                    type=ExperimentFlagType[data['type']],
-                    base_value=data['base_value'],
-                    ai_model=None)
-        if data.get('ai_model'):
-            flag.ai_model = AiModel.from_dict(data['ai_model'])
-        return flag
+    def _deserialize_flag(cls, item: Union[bytes, str]) -> Flag:
+        return cls._redis_connector.get_codec().decode_flag(item)
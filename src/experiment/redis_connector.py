@@ -1,20 +1,51 @@
-import dataclasses
 import json
-from typing import Optional
+import logging
+import time
+from typing import Optional, Dict, Callable, List, Tuple
 
 import redis
+from redis.client import PubSubWorkerThread
 
 from src.experiment.base import Experiment, Flag
+from src.experiment.codec import RecordCodec, JsonRecordCodec
+from src.experiment.config import SNAPSHOT_CHANGES_CHANNEL, SNAPSHOT_POLL_INTERVAL
+
+logger = logging.getLogger(__name__)
 
 
 class RedisConnector:
     _redis_client: redis.Redis
+    _codec: RecordCodec = JsonRecordCodec()
     _prefix_flag_experiments_key = "flag_experiments"
     _prefix_flag_key = "flag"
+    _changes_channel = SNAPSHOT_CHANGES_CHANNEL
+    _change_kind_flag = "flag"
+    _change_kind_experiments = "experiments"
+
+    # Monotonic config epochs, global counter and a sorted set of flag -> epoch of its last change
+    _config_version_key = "config_version"
+    _flags_config_version_key = "config_version_flags"
+    _bump_config_version_script_source = """
+        local version = redis.call('INCR', KEYS[1])
+        redis.call('ZADD', KEYS[2], version, ARGV[1])
+        return version
+    """
+    _bump_config_version_script = None
+
+    # Local snapshot, only used when enable_local_snapshot is called
+    _snapshot_enabled = False
+    _snapshot_flags: Dict[str, bytes] = {}
+    _snapshot_flag_experiments: Dict[str, Dict[str, bytes]] = {}
+    _snapshot_flag_versions: Dict[str, int] = {}
+    _snapshot_listeners: List[Callable[[str], None]] = []
+    _snapshot_thread: Optional[PubSubWorkerThread] = None
 
     @classmethod
-    def initialise(cls, redis_client: redis.Redis):
+    def initialise(cls, redis_client: redis.Redis, codec: Optional[RecordCodec] = None):
         cls._redis_client = redis_client
+        if codec is not None:
+            cls._codec = codec
+        cls._bump_config_version_script = redis_client.register_script(cls._bump_config_version_script_source)
 
         # Configure RDB to snapshot less frequently
         # Save every 5 minutes if at least 1 keys change
@@ -40,50 +71,294 @@ class RedisConnector:
 
     @classmethod
     def save_experiment(cls, experiment: Experiment, ttl: Optional[int] = None):
+        with cls._redis_client.pipeline(transaction=True) as pipeline:
+            cls._queue_save_experiment(pipeline, experiment, ttl)
+            cls._queue_change(pipeline, cls._change_kind_experiments, experiment.flag_name)
+            pipeline.execute()
+
+    @classmethod
+    def save_flag(cls, flag: Flag, ttl: Optional[int] = None):
+        with cls._redis_client.pipeline(transaction=True) as pipeline:
+            cls._queue_save_flag(pipeline, flag, ttl)
+            cls._queue_change(pipeline, cls._change_kind_flag, flag.name)
+            pipeline.execute()
+
+    @classmethod
+    def save_many(cls, flags: Optional[List[Flag]] = None, experiments: Optional[List[Experiment]] = None,
+                  ttl: Optional[int] = None):
+        """
+        Save flags and experiments in a single MULTI transaction, one round trip for the whole batch.
+        """
+        changes = {}
+        with cls._redis_client.pipeline(transaction=True) as pipeline:
+            for flag in flags or []:
+                cls._queue_save_flag(pipeline, flag, ttl)
+                changes[(cls._change_kind_flag, flag.name)] = None
+            for experiment in experiments or []:
+                cls._queue_save_experiment(pipeline, experiment, ttl)
+                changes[(cls._change_kind_experiments, experiment.flag_name)] = None
+            for kind, flag_name in changes:
+                cls._queue_change(pipeline, kind, flag_name)
+            pipeline.execute()
+
+    @classmethod
+    def _queue_save_experiment(cls, pipeline, experiment: Experiment, ttl: Optional[int] = None):
         key = cls._get_flag_experiments_key(experiment.flag_name)
-        experiment_data = dataclasses.asdict(experiment)
-        if experiment.ai_model:
-            experiment_data['ai_model'] = experiment.ai_model.to_dict()
-        else:
-            experiment_data['ai_model'] = None
-        cls._redis_client.hset(key, experiment.name, json.dumps(experiment_data))
+        pipeline.hset(key, experiment.name, cls._codec.encode_experiment(experiment))
         if ttl:
-            cls._redis_client.expire(key, ttl)
+            pipeline.expire(key, ttl)
 
     @classmethod
-    def save_flag(cls, flag: Flag, ttl: Optional[int] = None):
+    def _queue_save_flag(cls, pipeline, flag: Flag, ttl: Optional[int] = None):
         key = cls._get_flag_key(flag.name)
-        flag_data = dataclasses.asdict(flag)
-        if flag.ai_model:
-            flag_data['ai_model'] = flag.ai_model.to_dict()
-        else:
-            flag_data['ai_model'] = None
-        cls._redis_client.set(key, json.dumps(flag_data))
+        pipeline.set(key, cls._codec.encode_flag(flag))
         if ttl is not None:
-            cls._redis_client.expire(key, ttl)
+            pipeline.expire(key, ttl)
+
+    @classmethod
+    def get_codec(cls) -> RecordCodec:
+        return cls._codec
 
     @classmethod
     def get_experiments_by_flag_name(cls, flag_name: str):
+        if cls._snapshot_enabled:
+            return list(cls._snapshot_flag_experiments.get(flag_name, {}).values())
         key = cls._get_flag_experiments_key(flag_name)
         return cls._redis_client.hvals(key)
 
+    @classmethod
+    def get_experiments_with_version(cls, flag_name: str) -> Tuple[Optional[int], list]:
+        """
+        The flag's experiments and its config version in one round trip, the version is None for flags not
+        changed since config versions were introduced.
+        """
+        if cls._snapshot_enabled:
+            return (cls._snapshot_flag_versions.get(flag_name),
+                    list(cls._snapshot_flag_experiments.get(flag_name, {}).values()))
+        pipeline = cls._redis_client.pipeline(transaction=True)
+        pipeline.zscore(cls._flags_config_version_key, flag_name)
+        pipeline.hvals(cls._get_flag_experiments_key(flag_name))
+        version, experiments = pipeline.execute()
+        return (int(version) if version is not None else None), experiments
+
+    @classmethod
+    def get_experiments_for_flags(cls, flag_names: List[str]) -> List[list]:
+        """
+        Experiments of several flags in one pipelined round trip, in the order of flag_names.
+        """
+        if cls._snapshot_enabled:
+            return [list(cls._snapshot_flag_experiments.get(flag_name, {}).values()) for flag_name in flag_names]
+        if not flag_names:
+            return []
+        pipeline = cls._redis_client.pipeline(transaction=False)
+        for flag_name in flag_names:
+            pipeline.hvals(cls._get_flag_experiments_key(flag_name))
+        return pipeline.execute()
+
     @classmethod
     def get_experiment_by_flag_name(cls, flag_name: str, experiment_name: str):
+        if cls._snapshot_enabled:
+            return cls._snapshot_flag_experiments.get(flag_name, {}).get(experiment_name)
         return cls._redis_client.hget(cls._get_flag_experiments_key(flag_name), experiment_name)
 
     @classmethod
     def get_flag(cls, flag_name: str):
+        if cls._snapshot_enabled:
+            return cls._snapshot_flags.get(flag_name)
         key = cls._get_flag_key(flag_name)
         return cls._redis_client.get(key)
 
+    @classmethod
+    def get_flags(cls, flag_names: List[str]) -> list:
+        """
+        Flags in one MGET, in the order of flag_names, None for missing flags.
+        """
+        if cls._snapshot_enabled:
+            return [cls._snapshot_flags.get(flag_name) for flag_name in flag_names]
+        if not flag_names:
+            return []
+        return cls._redis_client.mget([cls._get_flag_key(flag_name) for flag_name in flag_names])
+
     @classmethod
     def delete_experiments_by_flag_name(cls, flag_name: str):
-        cls._redis_client.delete(cls._get_flag_experiments_key(flag_name))
+        with cls._redis_client.pipeline(transaction=True) as pipeline:
+            pipeline.delete(cls._get_flag_experiments_key(flag_name))
+            cls._queue_change(pipeline, cls._change_kind_experiments, flag_name)
+            pipeline.execute()
 
     @classmethod
     def delete_experiment(cls, flag_name: str, experiment_name: str):
-        cls._redis_client.hdel(cls._get_flag_experiments_key(flag_name), experiment_name)
+        with cls._redis_client.pipeline(transaction=True) as pipeline:
+            pipeline.hdel(cls._get_flag_experiments_key(flag_name), experiment_name)
+            cls._queue_change(pipeline, cls._change_kind_experiments, flag_name)
+            pipeline.execute()
 
     @classmethod
     def delete_flag(cls, flag_name: str):
-        cls._redis_client.delete(cls._get_flag_key(flag_name))
+        with cls._redis_client.pipeline(transaction=True) as pipeline:
+            pipeline.delete(cls._get_flag_key(flag_name))
+            cls._queue_change(pipeline, cls._change_kind_flag, flag_name)
+            pipeline.execute()
+
+    @classmethod
+    def get_config_version(cls) -> int:
+        version = cls._redis_client.get(cls._config_version_key)
+        return int(version) if version else 0
+
+    @classmethod
+    def get_changed_flags(cls, since_version: int) -> Tuple[int, Dict[str, int]]:
+        """
+        Return the current config version and the flags changed after since_version with their versions.
+        """
+        pipeline = cls._redis_client.pipeline(transaction=True)
+        pipeline.get(cls._config_version_key)
+        pipeline.zrangebyscore(cls._flags_config_version_key, f"({since_version}", "+inf", withscores=True)
+        version, changed_flags = pipeline.execute()
+        return (int(version) if version else 0,
+                {cls._to_str(flag_name): int(flag_version) for flag_name, flag_version in changed_flags})
+
+    @classmethod
+    def enable_local_snapshot(cls, on_change: Optional[Callable[[str], None]] = None):
+        """
+        Load every flag and its experiments into memory and serve all reads from there.
+        The snapshot is kept up to date by the change notifications published on every save/delete.
+        """
+        if on_change is not None:
+            cls._snapshot_listeners.append(on_change)
+        if cls._snapshot_enabled:
+            return cls
+
+        # Subscribe before loading so no change between the load and the subscription is lost
+        pubsub = cls._redis_client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{cls._changes_channel: cls._handle_change_message})
+        cls._load_local_snapshot()
+        cls._snapshot_thread = pubsub.run_in_thread(sleep_time=SNAPSHOT_POLL_INTERVAL, daemon=True,
+                                                    exception_handler=cls._handle_subscription_error)
+        cls._snapshot_enabled = True
+        return cls
+
+    @classmethod
+    def disable_local_snapshot(cls):
+        cls._snapshot_enabled = False
+        if cls._snapshot_thread is not None:
+            cls._snapshot_thread.stop()
+            cls._snapshot_thread = None
+        cls._snapshot_flags = {}
+        cls._snapshot_flag_experiments = {}
+        cls._snapshot_flag_versions = {}
+        cls._snapshot_listeners = []
+
+    @classmethod
+    def _load_local_snapshot(cls):
+        flags_prefix = f"{cls._prefix_flag_key}_"
+        flag_experiments_prefix = f"{cls._prefix_flag_experiments_key}_"
+
+        flag_names = [cls._to_str(key)[len(flags_prefix):]
+                      for key in cls._redis_client.scan_iter(match=f"{flags_prefix}*", _type="string")]
+        experiments_flag_names = [cls._to_str(key)[len(flag_experiments_prefix):]
+                                  for key in cls._redis_client.scan_iter(match=f"{flag_experiments_prefix}*",
+                                                                         _type="hash")]
+
+        pipeline = cls._redis_client.pipeline(transaction=False)
+        pipeline.zrange(cls._flags_config_version_key, 0, -1, withscores=True)
+        if flag_names:
+            pipeline.mget([cls._get_flag_key(flag_name) for flag_name in flag_names])
+        for flag_name in experiments_flag_names:
+            pipeline.hgetall(cls._get_flag_experiments_key(flag_name))
+        results = pipeline.execute()
+        flag_versions = results.pop(0)
+        flags_data = results.pop(0) if flag_names else []
+
+        flags = {flag_name: data for flag_name, data in zip(flag_names, flags_data) if data is not None}
+        flag_experiments = {flag_name: cls._decode_hash_keys(data)
+                            for flag_name, data in zip(experiments_flag_names, results)}
+        cls._snapshot_flags = flags
+        cls._snapshot_flag_experiments = flag_experiments
+        cls._snapshot_flag_versions = {cls._to_str(flag_name): int(version) for flag_name, version in flag_versions}
+
+    @classmethod
+    def _refresh_local_snapshot(cls, kind: str, flag_name: str):
+        if kind == cls._change_kind_flag:
+            data = cls._redis_client.get(cls._get_flag_key(flag_name))
+            if data is None:
+                cls._snapshot_flags.pop(flag_name, None)
+            else:
+                cls._snapshot_flags[flag_name] = data
+        else:
+            pipeline = cls._redis_client.pipeline(transaction=True)
+            pipeline.zscore(cls._flags_config_version_key, flag_name)
+            pipeline.hgetall(cls._get_flag_experiments_key(flag_name))
+            version, data = pipeline.execute()
+            if version is not None:
+                cls._snapshot_flag_versions[flag_name] = int(version)
+            if data:
+                # Replace the whole mapping so concurrent readers never see a partially updated flag
+                cls._snapshot_flag_experiments[flag_name] = cls._decode_hash_keys(data)
+            else:
+                cls._snapshot_flag_experiments.pop(flag_name, None)
+        for listener in cls._snapshot_listeners:
+            listener(flag_name)
+
+    @classmethod
+    def subscribe_changes(cls, on_change: Callable[[str], None],
+                          on_reconnect: Optional[Callable[[], None]] = None) -> PubSubWorkerThread:
+        """
+        Call on_change with the flag name of every flag or experiment change, on a daemon thread.
+        on_reconnect is called after the subscription recovered from an error, changes may have been missed.
+        Stop the returned thread to unsubscribe.
+        """
+        def handle_message(message):
+            on_change(json.loads(message['data'])['flag_name'])
+
+        def handle_error(exception, pubsub, thread):
+            logger.warning("Change subscription failed, resubscribing: %s", exception)
+            time.sleep(SNAPSHOT_POLL_INTERVAL)
+            if on_reconnect is not None:
+                try:
+                    on_reconnect()
+                except Exception:
+                    logger.exception("Change resubscription callback failed")
+
+        pubsub = cls._redis_client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{cls._changes_channel: handle_message})
+        return pubsub.run_in_thread(sleep_time=SNAPSHOT_POLL_INTERVAL, daemon=True, exception_handler=handle_error)
+
+    @classmethod
+    def _handle_change_message(cls, message):
+        change = json.loads(message['data'])
+        cls._refresh_local_snapshot(change['kind'], change['flag_name'])
+
+    @classmethod
+    def _handle_subscription_error(cls, exception, pubsub, thread):
+        """
+        Changes may have been missed while the subscription was broken, so reload the whole snapshot.
+        """
+        logger.warning("Local snapshot subscription failed, reloading snapshot: %s", exception)
+        time.sleep(SNAPSHOT_POLL_INTERVAL)
+        try:
+            cls._load_local_snapshot()
+            flag_names = set(cls._snapshot_flags) | set(cls._snapshot_flag_experiments)
+            for flag_name in flag_names:
+                for listener in cls._snapshot_listeners:
+                    listener(flag_name)
+        except redis.RedisError as ex:
+            logger.warning("Local snapshot reload failed: %s", ex)
+
+    @classmethod
+    def _queue_change(cls, pipeline, kind: str, flag_name: str):
+        """
+        Bump the global and flag config versions and notify the local snapshots, as part of the pipeline.
+        """
+        cls._bump_config_version_script(keys=[cls._config_version_key, cls._flags_config_version_key],
+                                        args=[flag_name], client=pipeline)
+        pipeline.publish(cls._changes_channel, json.dumps({"kind": kind, "flag_name": flag_name}))
+
+    @staticmethod
+    def _decode_hash_keys(data: dict) -> Dict[str, bytes]:
+        return {RedisConnector._to_str(key): value for key, value in data.items()}
+
+    @staticmethod
+    def _to_str(value) -> str:
+        if isinstance(value, bytes):
+            return value.decode('utf-8')
+        return value
@@ -1,5 +1,33 @@
+import os
+import tempfile
+
 import redis
 
 REDIS_CLIENT = redis.Redis()
 REFRESH_EXPERIMENT_INTERVAL = 1 * 10
+MODEL_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+MODEL_LATEST_VERSION_TTL = 5
+MODEL_VERSION_CHANNEL = "experiment_controller_model_versions"
+MODEL_RECONCILE_INTERVAL = 10 * 60
+LOCAL_MODEL_STORE_DIR = os.path.join(tempfile.gettempdir(), 'experiment_controller_models')
+MODEL_METADATA_CACHE_TTL = 5
+MODEL_METADATA_CACHE_SIZE = 1024
+MODEL_COMPRESSION = None
+MODEL_CHUNK_SIZE_BYTES = 4 * 1024 * 1024
+POSTGRES_POOL_SIZE = 10
+POSTGRES_MAX_OVERFLOW = 20
+POSTGRES_POOL_TIMEOUT = 30
+POSTGRES_POOL_RECYCLE = 30 * 60
+KAFKA_LINGER_MS = 20
+KAFKA_BATCH_SIZE = 256 * 1024
+KAFKA_COMPRESSION_TYPE = None
+KAFKA_NUM_PARTITIONS = 6
+KAFKA_REPLICATION_FACTOR = 1
+KAFKA_LOAD_BATCH_SIZE = 10000
+KAFKA_POLL_TIMEOUT_MS = 1000
+KAFKA_LOAD_MAX_IDLE_MS = 30000
+KAFKA_LOAD_WORKERS = 4
+KAFKA_LOAD_MAX_PENDING_BATCHES = 8
+FILE_DATA_ROW_GROUP_SIZE = 64 * 1024
+FILE_DATA_MAX_BUFFERED_ROWS = 256 * 1024
 LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %s - %(message)s'
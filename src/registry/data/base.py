@@ -1,5 +1,9 @@
 from abc import ABC, abstractmethod
-from typing import Optional
+from typing import Optional, Iterable, Iterator, List, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pandas as pd
+    import pyarrow as pa
 
 
 class DataRegisteryInterface(ABC):
@@ -7,6 +11,44 @@ class DataRegisteryInterface(ABC):
     def publish(self, data, data_name: str, experiment: str, version: Optional[int] = None, **kwargs):
         pass
 
+    def publish_many(self, data: Iterable, data_name: str, experiment: str, version: Optional[int] = None,
+                     **kwargs) -> int:
+        """
+        Publish every record of data, returns the number of records. Delivery is only guaranteed after flush.
+        """
+        count = 0
+        for record in data:
+            self.publish(record, data_name=data_name, experiment=experiment, version=version, **kwargs)
+            count += 1
+        return count
+
+    def flush(self, timeout: Optional[float] = None):
+        pass
+
     @abstractmethod
     def load(self, data_name: str, experiment: str, version: Optional[int] = None, **kwargs):
         pass
+
+    def iter_load(self, data_name: str, experiment: str, version: Optional[int] = None, **kwargs) -> Iterator[List]:
+        """
+        Yield the records in micro-batches, registries that can stream override this.
+        """
+        yield self.load(data_name=data_name, experiment=experiment, version=version, **kwargs)
+
+    def load_arrow(self, data_name: str, experiment: str, version: Optional[int] = None,
+                   schema: Optional['pa.Schema'] = None, **kwargs) -> 'pa.Table':
+        """
+        Load the records as an Arrow table, the schema is inferred from the records if not given.
+        """
+        # Training only, pyarrow stays off the serving import path
+        import pyarrow as pa
+
+        return pa.Table.from_pylist(self.load(data_name=data_name, experiment=experiment, version=version, **kwargs),
+                                    schema=schema)
+
+    def load_frame(self, data_name: str, experiment: str, version: Optional[int] = None,
+                   schema: Optional['pa.Schema'] = None, **kwargs) -> 'pd.DataFrame':
+        table = self.load_arrow(data_name=data_name, experiment=experiment, version=version, schema=schema,
+                                **kwargs)
+        # Release the Arrow buffers while converting instead of holding both copies
+        return table.to_pandas(split_blocks=True, self_destruct=True)
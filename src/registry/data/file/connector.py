@@ -0,0 +1,197 @@
+import io
+import json
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, date
+from typing import Optional, List, Iterator, Dict, Tuple, Union
+from urllib.parse import quote
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.json
+import pyarrow.parquet as pq
+from pyarrow import fs
+
+from src.registry.config import FILE_DATA_ROW_GROUP_SIZE, FILE_DATA_MAX_BUFFERED_ROWS
+from src.registry.data.base import DataRegisteryInterface
+
+
+class FileDataRegistry(DataRegisteryInterface):
+    """
+    Experiment data as Parquet or Arrow IPC files under a local or NFS directory, hive partitioned as
+    root_dir/data_name=.../experiment=.../date=YYYY-MM-DD/part-*.parquet
+
+    Published records (JSON strings or dicts) are buffered and written by flush as new immutable files with row
+    groups of row_group_size rows, files are never rewritten. Loads prune the date partitions, push filters down to
+    the Parquet row group statistics, read only the requested columns and memory-map the files.
+    """
+    PARQUET = 'parquet'
+    ARROW = 'arrow'
+    _date_field = 'date'
+
+    def __init__(self, root_dir: str, file_format: str = PARQUET, row_group_size: int = FILE_DATA_ROW_GROUP_SIZE,
+                 max_buffered_rows: int = FILE_DATA_MAX_BUFFERED_ROWS):
+        """
+        ARROW files are uncompressed, memory-mapped reads then need no decoding at all.
+        A partition's buffer is written as soon as it holds max_buffered_rows records.
+        """
+        if file_format not in (self.PARQUET, self.ARROW):
+            raise ValueError(f"Unknown file format {file_format}")
+        self.root_dir = root_dir
+        self.file_format = file_format
+        self.row_group_size = row_group_size
+        self.max_buffered_rows = max_buffered_rows
+        self._filesystem = fs.LocalFileSystem(use_mmap=True)
+        self._buffers: Dict[Tuple[str, str, str], List[bytes]] = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def publish(self, data, data_name: str, experiment: str, version: Optional[int] = None, **kwargs):
+        """
+        Buffer one record, it is written by flush. kwargs may set the partition date (datetime.date or ISO string),
+        today (UTC) by default.
+        """
+        key = (data_name, experiment, self._get_date(kwargs.pop('date', None)))
+        with self._lock:
+            buffer = self._buffers[key]
+            buffer.append(self._encode(data))
+            if len(buffer) < self.max_buffered_rows:
+                return
+            del self._buffers[key]
+        self._write_or_requeue(key, buffer)
+
+    def flush(self, timeout: Optional[float] = None):
+        """
+        Write every buffered partition. If a write fails (a record Arrow can't decode, disk full...) its records
+        and those of the partitions not written yet are put back in the buffers and the error is raised.
+        """
+        with self._lock:
+            buffers, self._buffers = self._buffers, defaultdict(list)
+        pending = list(buffers.items())
+        for index, (key, buffer) in enumerate(pending):
+            try:
+                self._write(key, buffer)
+            except BaseException:
+                self._requeue(pending[index:])
+                raise
+
+    def _write_or_requeue(self, key: Tuple[str, str, str], buffer: List[bytes]):
+        try:
+            self._write(key, buffer)
+        except BaseException:
+            self._requeue([(key, buffer)])
+            raise
+
+    def _requeue(self, buffers: List[Tuple[Tuple[str, str, str], List[bytes]]]):
+        with self._lock:
+            for key, buffer in buffers:
+                # Records published meanwhile go after the requeued ones
+                self._buffers[key][:0] = buffer
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.flush()
+
+    def load(self, data_name: str, experiment: str, version: Optional[int] = None, **kwargs):
+        return self.load_arrow(data_name, experiment, version, **kwargs).to_pylist()
+
+    def iter_load(self, data_name: str, experiment: str, version: Optional[int] = None,
+                  batch_size: int = FILE_DATA_ROW_GROUP_SIZE, **kwargs) -> Iterator[List]:
+        dataset = self._get_dataset(data_name, experiment, kwargs.pop('schema', None))
+        if dataset is None:
+            return
+        for record_batch in dataset.to_batches(batch_size=batch_size, **self._get_scan_options(**kwargs)):
+            if record_batch.num_rows:
+                yield record_batch.to_pylist()
+
+    def load_arrow(self, data_name: str, experiment: str, version: Optional[int] = None,
+                   schema: Optional[pa.Schema] = None, columns: Optional[List[str]] = None,
+                   filter: Optional[ds.Expression] = None, start_date: Union[date, str, None] = None,
+                   end_date: Union[date, str, None] = None, **kwargs) -> pa.Table:
+        """
+        columns projects the read, filter is a pyarrow.dataset expression e.g. ds.field('age') > 30, the date
+        partitions between start_date and end_date (inclusive) are read. Without a schema the files' schemas are
+        unified.
+        """
+        dataset = self._get_dataset(data_name, experiment, schema)
+        if dataset is None:
+            return schema.empty_table() if schema is not None else pa.table({})
+        return dataset.to_table(**self._get_scan_options(columns=columns, filter=filter, start_date=start_date,
+                                                         end_date=end_date))
+
+    def _get_dataset(self, data_name: str, experiment: str, schema: Optional[pa.Schema]) -> Optional[ds.Dataset]:
+        experiment_dir = self._get_experiment_dir(data_name, experiment)
+        if not os.path.isdir(experiment_dir):
+            return None
+        file_format = ds.ParquetFileFormat() if self.file_format == self.PARQUET else ds.IpcFileFormat()
+        partitioning = ds.partitioning(pa.schema([(self._date_field, pa.string())]), flavor='hive')
+        if schema is None:
+            # Files written at different times may have inferred different schemas, only the footers are read
+            dataset = ds.dataset(experiment_dir, format=file_format, partitioning=partitioning,
+                                 filesystem=self._filesystem)
+            schemas = [fragment.physical_schema for fragment in dataset.get_fragments()]
+            if not schemas:
+                # The directories exist but no file was completely written yet
+                return None
+            schema = pa.unify_schemas(schemas, promote_options='permissive')
+        if self._date_field not in schema.names:
+            schema = schema.append(pa.field(self._date_field, pa.string()))
+        # Each file is cast to the schema while it is scanned
+        return ds.dataset(experiment_dir, schema=schema, format=file_format, partitioning=partitioning,
+                          filesystem=self._filesystem)
+
+    def _get_scan_options(self, columns: Optional[List[str]] = None, filter: Optional[ds.Expression] = None,
+                          start_date: Union[date, str, None] = None, end_date: Union[date, str, None] = None,
+                          **kwargs) -> dict:
+        # ISO dates compare as strings, the date bounds prune whole partitions
+        if start_date is not None:
+            start_filter = ds.field(self._date_field) >= self._get_date(start_date)
+            filter = start_filter if filter is None else filter & start_filter
+        if end_date is not None:
+            end_filter = ds.field(self._date_field) <= self._get_date(end_date)
+            filter = end_filter if filter is None else filter & end_filter
+        return {'columns': columns, 'filter': filter}
+
+    def _write(self, key: Tuple[str, str, str], buffer: List[bytes]):
+        data_name, experiment, partition_date = key
+        table = pyarrow.json.read_json(io.BytesIO(b'\n'.join(buffer)))
+        directory = os.path.join(self._get_experiment_dir(data_name, experiment),
+                                 f"{self._date_field}={partition_date}")
+        os.makedirs(directory, exist_ok=True)
+
+        file_name = f"part-{time.time_ns()}-{uuid.uuid4().hex}.{self.file_format}"
+        # Readers ignore dot files, the file only becomes visible once complete
+        temporary_path = os.path.join(directory, f".{file_name}")
+        if self.file_format == self.PARQUET:
+            pq.write_table(table, temporary_path, row_group_size=self.row_group_size)
+        else:
+            with pa.OSFile(temporary_path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table, max_chunksize=self.row_group_size)
+        os.replace(temporary_path, os.path.join(directory, file_name))
+
+    def _get_experiment_dir(self, data_name: str, experiment: str) -> str:
+        return os.path.join(self.root_dir, f"data_name={quote(data_name, safe='')}",
+                            f"experiment={quote(experiment, safe='')}")
+
+    @staticmethod
+    def _get_date(value: Union[date, str, None]) -> str:
+        if value is None:
+            return datetime.utcnow().strftime('%Y-%m-%d')
+        if isinstance(value, date):
+            return value.strftime('%Y-%m-%d')
+        return value
+
+    @staticmethod
+    def _encode(data) -> bytes:
+        if isinstance(data, bytes):
+            return data
+        if isinstance(data, str):
+            return data.encode('utf-8')
+        return json.dumps(data).encode('utf-8')
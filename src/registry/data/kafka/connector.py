@@ -1,45 +1,471 @@
+import hashlib
+import io
 import json
-from typing import Optional
+import queue
+import re
+import threading
+import time
+from contextlib import closing
+from typing import Optional, Callable, List, Iterator, Dict, TYPE_CHECKING
 
 from kafka import KafkaProducer, KafkaConsumer, TopicPartition
 
+from src.registry.config import KAFKA_LINGER_MS, KAFKA_BATCH_SIZE, KAFKA_COMPRESSION_TYPE, KAFKA_LOAD_BATCH_SIZE, \
+    KAFKA_POLL_TIMEOUT_MS, KAFKA_NUM_PARTITIONS, KAFKA_REPLICATION_FACTOR, KAFKA_LOAD_WORKERS, \
+    KAFKA_LOAD_MAX_PENDING_BATCHES, KAFKA_LOAD_MAX_IDLE_MS
 from src.registry.data.base import DataRegisteryInterface
+from src.registry.exception import DataPublishFailed, DataLoadTimeout
+
+if TYPE_CHECKING:
+    import pyarrow as pa
 
 
 class KafkaRegistry(DataRegisteryInterface):
+    """
+    publish and publish_many only enqueue records, the producer sends them in batches of batch_size bytes waiting
+    up to linger_ms for a batch to fill. Call flush (or use the registry as a context manager) to wait for the
+    delivery, failed deliveries are raised by flush.
+    Records carry data_name, experiment and version headers, loads filter on them without decoding the values.
+    Records published before the headers were added have none, loads skip them unless include_unlabelled is set.
+
+    Routing: with ROUTE_BY_KEY every record goes to the shared topic keyed by data_name and experiment, so the
+    records of an experiment stay on one partition while experiments spread over the partitions, loads only read
+    that partition. With
+    ROUTE_BY_TOPIC every (data_name, experiment) gets its own topic and its records spread over all of its
+    partitions. Topics are created on first use unless auto_create_topics is False.
+    """
+    ROUTE_BY_KEY = 'key'
+    ROUTE_BY_TOPIC = 'topic'
     _topic: str = "experiment_controller"
+    _data_name_header: str = "data_name"
+    _experiment_header: str = "experiment"
+    _version_header: str = "version"
+    _max_topic_length: int = 249
+    # Producer configs that describe the cluster connection, shared with the load consumers and the admin client
+    _connection_config_keys = (
+        'bootstrap_servers', 'client_id', 'security_protocol', 'ssl_context', 'ssl_check_hostname', 'ssl_cafile',
+        'ssl_certfile', 'ssl_keyfile', 'ssl_password', 'ssl_crlfile', 'ssl_ciphers', 'sasl_mechanism',
+        'sasl_plain_username', 'sasl_plain_password', 'sasl_kerberos_service_name', 'sasl_kerberos_domain_name',
+        'sasl_oauth_token_provider', 'api_version', 'api_version_auto_timeout_ms', 'metadata_max_age_ms',
+        'reconnect_backoff_ms', 'reconnect_backoff_max_ms', 'receive_buffer_bytes', 'send_buffer_bytes',
+        'socket_options')
 
-    def __init__(self, topic=None, **configs):
+    def __init__(self, topic=None, on_delivery: Optional[Callable[[object], None]] = None,
+                 on_error: Optional[Callable[[Exception], None]] = None, routing: str = ROUTE_BY_KEY,
+                 num_partitions: int = KAFKA_NUM_PARTITIONS, replication_factor: int = KAFKA_REPLICATION_FACTOR,
+                 auto_create_topics: bool = True, **configs):
+        """
+        configs are KafkaProducer configs, compression_type 'lz4' or 'zstd' compresses whole batches (needs the
+        lz4 or zstandard package, KafkaProducer refuses a codec whose library is missing).
+        on_delivery receives the RecordMetadata of every delivered record, on_error every delivery error.
+        num_partitions and replication_factor apply to the topics this registry creates. The connection configs
+        (bootstrap_servers, security_protocol, ssl_* and sasl_*...) are also used by the loads and the admin client.
+        """
         if topic is not None:
             self._topic = topic
+        if routing not in (self.ROUTE_BY_KEY, self.ROUTE_BY_TOPIC):
+            raise ValueError(f"Unknown routing {routing}")
+        self.routing = routing
+        self.num_partitions = num_partitions
+        self.replication_factor = replication_factor
+        self.auto_create_topics = auto_create_topics
+        self._created_topics = set()
+        self._topics_lock = threading.Lock()
         self.bootstrap_servers = configs.get("bootstrap_servers", "localhost:9092")
+        self._connection_configs = {key: value for key, value in configs.items()
+                                    if key in self._connection_config_keys}
+        self._connection_configs["bootstrap_servers"] = self.bootstrap_servers
+        configs.setdefault("linger_ms", KAFKA_LINGER_MS)
+        configs.setdefault("batch_size", KAFKA_BATCH_SIZE)
+        configs.setdefault("compression_type", KAFKA_COMPRESSION_TYPE)
         self.producer = KafkaProducer(
             **configs,
         )
+        self.on_delivery = on_delivery
+        self.on_error = on_error
+        self._errors: List[Exception] = []
+        self._errors_lock = threading.Lock()
 
     def publish(self, data, data_name: str, experiment: str, version: Optional[int] = None, **kwargs):
-        self.producer.send(topic=self._topic, value=data.encode('utf-8'), partition=kwargs.pop('partition', None))
-        self.producer.flush()
+        """
+        Enqueue one record, returns the send future.
+        """
+        topic = self._get_topic(data_name, experiment)
+        self._ensure_topic(topic)
+        key = self._get_key(data_name, experiment) if self.routing == self.ROUTE_BY_KEY else None
+        future = self.producer.send(topic=topic, value=self._encode(data), key=key,
+                                    partition=kwargs.pop('partition', None),
+                                    headers=self._get_headers(data_name, experiment, version))
+        if self.on_delivery is not None:
+            future.add_callback(self.on_delivery)
+        future.add_errback(self._on_send_error)
+        return future
+
+    def flush(self, timeout: Optional[float] = None):
+        """
+        Block until every enqueued record is delivered, raises DataPublishFailed if any delivery failed since
+        the previous flush.
+        """
+        self.producer.flush(timeout=timeout)
+        with self._errors_lock:
+            errors, self._errors = self._errors, []
+        if errors:
+            raise DataPublishFailed(f"{len(errors)} records failed to publish", errors)
+
+    def close(self, timeout: Optional[float] = None):
+        try:
+            self.flush(timeout=timeout)
+        finally:
+            self.producer.close(timeout=timeout)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.flush()
+
+    def _on_send_error(self, exception: Exception):
+        with self._errors_lock:
+            self._errors.append(exception)
+        if self.on_error is not None:
+            self.on_error(exception)
+
+    def _get_topic(self, data_name: str, experiment: str) -> str:
+        if self.routing == self.ROUTE_BY_TOPIC:
+            # Topic names only allow ASCII alphanumerics, '.', '_' and '-' up to 249 characters. Sanitized names may
+            # collide (e.g. 'a.b' + 'c' and 'a' + 'b.c'), the hash of the exact pair keeps them apart
+            digest = hashlib.sha1(json.dumps([data_name, experiment]).encode('utf-8')).hexdigest()[:10]
+            name = re.sub(r'[^a-zA-Z0-9._-]', '_', f"{self._topic}.{data_name}.{experiment}")
+            return f"{name[:self._max_topic_length - len(digest) - 1]}.{digest}"
+        return self._topic
+
+    def _get_partitions(self, consumer: KafkaConsumer, topic: str, data_name: str, experiment: str,
+                        include_unlabelled: bool) -> List[int]:
+        partitions = sorted(consumer.partitions_for_topic(topic) or [])
+        if self.routing != self.ROUTE_BY_KEY or include_unlabelled or not partitions:
+            return partitions
+        # The producer's partitioner is called with the sorted partitions too, it picks the same one
+        return [self.producer.config['partitioner'](self._get_key(data_name, experiment), partitions, partitions)]
+
+    @staticmethod
+    def _get_key(data_name: str, experiment: str) -> bytes:
+        return f"{data_name}|{experiment}".encode('utf-8')
+
+    def _ensure_topic(self, topic: str):
+        if not self.auto_create_topics or topic in self._created_topics:
+            return
+        # kafka-python < 1.4.4 has no admin client, only registries creating topics need it
+        from kafka import KafkaAdminClient
+        from kafka.admin import NewTopic
+        from kafka.errors import TopicAlreadyExistsError
+
+        with self._topics_lock:
+            if topic in self._created_topics:
+                return
+            admin_client = KafkaAdminClient(**{key: value for key, value in self._connection_configs.items()
+                                               if key in KafkaAdminClient.DEFAULT_CONFIG})
+            try:
+                admin_client.create_topics([NewTopic(name=topic, num_partitions=self.num_partitions,
+                                                     replication_factor=self.replication_factor)])
+            except TopicAlreadyExistsError:
+                pass
+            finally:
+                admin_client.close()
+            self._created_topics.add(topic)
+
+    def _get_headers(self, data_name: str, experiment: str, version: Optional[int]) -> list:
+        headers = [(self._data_name_header, data_name.encode('utf-8')),
+                   (self._experiment_header, experiment.encode('utf-8'))]
+        if version is not None:
+            headers.append((self._version_header, str(version).encode('utf-8')))
+        return headers
+
+    @staticmethod
+    def _encode(data) -> bytes:
+        if isinstance(data, bytes):
+            return data
+        return data.encode('utf-8')
 
     def load(self, data_name: str, experiment: str, version: Optional[int] = None, **kwargs):
+        return [value for batch in self.iter_load(data_name, experiment, version, **kwargs) for value in batch]
+
+    def iter_load(self, data_name: str, experiment: str, version: Optional[int] = None,
+                  batch_size: int = KAFKA_LOAD_BATCH_SIZE, partition: Optional[int] = None,
+                  start_offset: Optional[int] = None, end_offset: Optional[int] = None,
+                  start_timestamp_ms: Optional[int] = None, end_timestamp_ms: Optional[int] = None,
+                  group_id: Optional[str] = None, decode: bool = True, include_unlabelled: bool = False,
+                  max_idle_ms: Optional[int] = KAFKA_LOAD_MAX_IDLE_MS, **kwargs) -> Iterator[List]:
+        """
+        Yield micro-batches of at most batch_size records of data_name and experiment (and version if given).
+        Records published without headers, before records were labelled, can't be told apart: they are skipped
+        unless include_unlabelled, which yields all of them whatever their data_name and experiment (narrow them
+        down with partition or the offset bounds).
 
+        Reads the partition of the key with ROUTE_BY_KEY (computed with the producer's partitioner, records sent
+        with an explicit partition or before the topic's partitions were added are only found with partition or
+        include_unlabelled), every partition of the topic with ROUTE_BY_TOPIC, or only partition, from start_offset / start_timestamp_ms up to the
+        end offsets at the time of the call, or up to end_offset / end_timestamp_ms (exclusive).
+        With a group_id, the offsets are committed after each batch is consumed and a later call without a start
+        resumes from them. decode=False yields the raw values.
+        The consumer fetches from all the partitions at once. Raises DataLoadTimeout if no record arrives for
+        max_idle_ms before the end offsets are reached (e.g. records deleted by retention), None waits forever.
+        """
+        topic = self._get_topic(data_name, experiment)
         consumer = KafkaConsumer(
-            bootstrap_servers=self.bootstrap_servers,
+            **self._connection_configs,
+            group_id=group_id,
             auto_offset_reset='earliest',
-            value_deserializer=lambda m: json.loads(m.decode('utf-8')),
-            consumer_timeout_ms=1000,
-            enable_auto_commit=True
+            enable_auto_commit=False,
+            max_poll_records=batch_size,
         )
+        try:
+            if partition is not None:
+                partitions = [TopicPartition(topic, partition)]
+            else:
+                partitions = [TopicPartition(topic, p) for p in self._get_partitions(
+                    consumer, topic, data_name, experiment, include_unlabelled)]
+            consumer.assign(partitions)
+            end_offsets = self._get_end_offsets(consumer, partitions, end_offset, end_timestamp_ms)
+            self._seek_start(consumer, partitions, end_offsets, start_offset, start_timestamp_ms, group_id)
+
+            expected_headers = {self._data_name_header: data_name.encode('utf-8'),
+                                self._experiment_header: experiment.encode('utf-8')}
+            if version is not None:
+                expected_headers[self._version_header] = str(version).encode('utf-8')
 
-        topic_partition = TopicPartition(self._topic, kwargs.pop('partition', None))
+            remaining = {tp for tp in partitions if consumer.position(tp) < end_offsets[tp]}
+            last_record_at = time.monotonic()
+            while remaining:
+                batch = []
+                polled = consumer.poll(timeout_ms=KAFKA_POLL_TIMEOUT_MS, max_records=batch_size)
+                if polled:
+                    last_record_at = time.monotonic()
+                elif max_idle_ms is not None and (time.monotonic() - last_record_at) * 1000 >= max_idle_ms:
+                    raise DataLoadTimeout(
+                        f"No record of {topic} received for {max_idle_ms} ms, partitions "
+                        f"{sorted(tp.partition for tp in remaining)} did not reach their end offsets")
+                for tp, records in polled.items():
+                    for record in records:
+                        if record.offset >= end_offsets[tp]:
+                            break
+                        if self._matches(record.headers, expected_headers, include_unlabelled):
+                            batch.append(json.loads(record.value) if decode else record.value)
+                    if consumer.position(tp) >= end_offsets[tp]:
+                        # Don't checkpoint past the end, the records after it belong to a later load
+                        consumer.seek(tp, end_offsets[tp])
+                        remaining.discard(tp)
+                if batch:
+                    yield batch
+                if group_id is not None:
+                    consumer.commit()
+        finally:
+            consumer.close()
 
-        consumer.assign([topic_partition])
+    def load_arrow(self, data_name: str, experiment: str, version: Optional[int] = None,
+                   schema: Optional['pa.Schema'] = None, workers: int = 1, **kwargs) -> 'pa.Table':
+        """
+        Decode each micro-batch of raw JSON values with the Arrow JSON reader, no Python dict is built per record.
+        Without a schema each batch's schema is inferred and the batches are widened to a common schema (e.g. a
+        column null in the first batch and a string later becomes a string column), a column whose types can't be
+        widened (e.g. numbers in one record and strings in another) is loaded as strings. Fields missing from a
+        given schema are dropped. With workers > 1 the partitions are loaded in parallel, see iter_arrow_parallel;
+        the result is the same.
+        """
+        if workers > 1 and kwargs.get('partition') is None:
+            tables = list(self.iter_arrow_parallel(data_name, experiment, version, schema=schema, workers=workers,
+                                                   **kwargs))
+        else:
+            tables = [self._decode_batch(batch, schema)
+                      for batch in self.iter_load(data_name, experiment, version, decode=False, **kwargs)]
+        return self._concat_tables(tables, schema)
 
-        all_data = []
+    def iter_arrow_parallel(self, data_name: str, experiment: str, version: Optional[int] = None,
+                            schema: Optional['pa.Schema'] = None, workers: int = KAFKA_LOAD_WORKERS,
+                            max_pending_batches: int = KAFKA_LOAD_MAX_PENDING_BATCHES,
+                            **kwargs) -> Iterator['pa.Table']:
+        """
+        Split the topic's partitions over workers threads, each with its own consumer, reading and decoding its
+        partitions into Arrow tables. Tables are yielded as they are decoded, in no particular order.
+        At most max_pending_batches decoded tables wait to be consumed, workers block beyond that so a slow
+        consumer of this generator bounds the memory. iter_load options (bounds, group_id...) apply per partition.
+        """
+        topic = self._get_topic(data_name, experiment)
+        consumer = KafkaConsumer(**self._connection_configs)
         try:
-            for message in consumer:
-                all_data.append(message.value)
+            partitions = self._get_partitions(consumer, topic, data_name, experiment,
+                                              kwargs.get('include_unlabelled', False))
         finally:
             consumer.close()
+        if not partitions:
+            return
+
+        workers = min(workers, len(partitions))
+        tables: queue.Queue = queue.Queue(maxsize=max_pending_batches)
+        stopped = threading.Event()
+        done = object()
+
+        def put(item):
+            while not stopped.is_set():
+                try:
+                    tables.put(item, timeout=KAFKA_POLL_TIMEOUT_MS / 1000)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def load_partitions(worker_partitions: List[int]):
+            try:
+                for partition in worker_partitions:
+                    with closing(self.iter_load(data_name, experiment, version, partition=partition, decode=False,
+                                                **kwargs)) as batches:
+                        for batch in batches:
+                            # Stop between polls, without decoding a batch nobody will consume
+                            if stopped.is_set() or not put(self._decode_batch(batch, schema)):
+                                return
+            except BaseException as ex:
+                put(ex)
+            finally:
+                put(done)
+
+        threads = [threading.Thread(target=load_partitions, args=(partitions[index::workers],), daemon=True,
+                                    name=f'kafka-load-{index}')
+                   for index in range(workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            running = workers
+            while running:
+                item = tables.get()
+                if item is done:
+                    running -= 1
+                elif isinstance(item, BaseException):
+                    raise item
+                else:
+                    yield item
+        finally:
+            # Unblock the workers if the caller stopped early or a worker failed. A worker may be inside a poll,
+            # wait at most one poll timeout for them, they close their consumers and exit on their own
+            stopped.set()
+            deadline = time.monotonic() + KAFKA_POLL_TIMEOUT_MS / 1000
+            for thread in threads:
+                thread.join(timeout=max(0.0, deadline - time.monotonic()))
+
+    @staticmethod
+    def _decode_batch(batch: List[bytes], schema: Optional['pa.Schema']) -> 'pa.Table':
+        import pyarrow as pa
+        import pyarrow.json
+
+        payload = b'\n'.join(batch)
+        try:
+            return pyarrow.json.read_json(
+                io.BytesIO(payload),
+                # The reader infers the types of each block from that block, one block for the whole batch
+                read_options=pyarrow.json.ReadOptions(block_size=max(len(payload) + 1, 1 << 20)),
+                parse_options=pyarrow.json.ParseOptions(
+                    explicit_schema=schema, unexpected_field_behavior='infer' if schema is None else 'ignore'))
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            if schema is not None:
+                raise
+        # A column changed type within the batch (e.g. a number then a string), decode it as strings
+        records = [json.loads(value) for value in batch]
+        kinds: Dict[str, set] = {}
+        for record in records:
+            for name, value in record.items():
+                if value is not None:
+                    kinds.setdefault(name, set()).add(float if type(value) is int else type(value))
+        conflicting = {name for name, types in kinds.items() if len(types) > 1}
+        for record in records:
+            for name in conflicting.intersection(record):
+                record[name] = KafkaRegistry._to_string(record[name])
+        return pa.Table.from_pylist(records)
+
+    @staticmethod
+    def _concat_tables(tables: List['pa.Table'], schema: Optional['pa.Schema']) -> 'pa.Table':
+        import pyarrow as pa
+
+        if not tables:
+            return schema.empty_table() if schema is not None else pa.table({})
+        if schema is not None:
+            return pa.concat_tables(tables, promote_options='default')
+        # Batches decoded without a schema each have their own inferred one, widen them to a common one (null to
+        # any type, int64 to double...). Types that can't be widened (e.g. int64 and string) become strings
+        try:
+            return pa.concat_tables(tables, promote_options='permissive')
+        except (pa.ArrowTypeError, pa.ArrowInvalid):
+            pass
+        types: Dict[str, list] = {}
+        for table in tables:
+            for field in table.schema:
+                types.setdefault(field.name, []).append(field.type)
+        conflicting = set()
+        for name, field_types in types.items():
+            try:
+                pa.unify_schemas([pa.schema([pa.field(name, field_type)]) for field_type in field_types],
+                                 promote_options='permissive')
+            except (pa.ArrowTypeError, pa.ArrowInvalid):
+                conflicting.add(name)
+        tables = [KafkaRegistry._stringify_columns(table, conflicting) for table in tables]
+        return pa.concat_tables(tables, promote_options='permissive')
+
+    @staticmethod
+    def _stringify_columns(table: 'pa.Table', names: set) -> 'pa.Table':
+        import pyarrow as pa
+
+        for index, field in enumerate(table.schema):
+            if field.name not in names or pa.types.is_string(field.type):
+                continue
+            column = table.column(index)
+            try:
+                column = column.cast(pa.string())
+            except (pa.ArrowNotImplementedError, pa.ArrowInvalid):
+                # Nested types have no cast to string, use their JSON text
+                column = pa.array([None if value is None else KafkaRegistry._to_string(value)
+                                   for value in column.to_pylist()], pa.string())
+            table = table.set_column(index, pa.field(field.name, pa.string()), column)
+        return table
+
+    @staticmethod
+    def _to_string(value) -> Optional[str]:
+        if value is None or isinstance(value, str):
+            return value
+        return json.dumps(value)
+
+    @staticmethod
+    def _matches(headers, expected_headers: Dict[str, bytes], include_unlabelled: bool = False) -> bool:
+        if not headers:
+            # Published before records carried headers
+            return include_unlabelled
+        headers = dict(headers)
+        return all(headers.get(key) == value for key, value in expected_headers.items())
+
+    @staticmethod
+    def _get_end_offsets(consumer: KafkaConsumer, partitions: List[TopicPartition], end_offset: Optional[int],
+                         end_timestamp_ms: Optional[int]) -> Dict[TopicPartition, int]:
+        end_offsets = consumer.end_offsets(partitions)
+        if end_timestamp_ms is not None:
+            for tp, offset_and_timestamp in consumer.offsets_for_times(
+                    {tp: end_timestamp_ms for tp in partitions}).items():
+                if offset_and_timestamp is not None:
+                    end_offsets[tp] = offset_and_timestamp.offset
+        if end_offset is not None:
+            end_offsets = {tp: min(offset, end_offset) for tp, offset in end_offsets.items()}
+        return end_offsets
 
-        return all_data
+    @staticmethod
+    def _seek_start(consumer: KafkaConsumer, partitions: List[TopicPartition], end_offsets: Dict[TopicPartition, int],
+                    start_offset: Optional[int], start_timestamp_ms: Optional[int], group_id: Optional[str]):
+        if start_timestamp_ms is not None:
+            for tp, offset_and_timestamp in consumer.offsets_for_times(
+                    {tp: start_timestamp_ms for tp in partitions}).items():
+                consumer.seek(tp, offset_and_timestamp.offset if offset_and_timestamp else end_offsets[tp])
+        elif start_offset is not None:
+            for tp in partitions:
+                consumer.seek(tp, start_offset)
+        else:
+            for tp in partitions:
+                # Resume from the group's checkpoint
+                committed = consumer.committed(tp) if group_id is not None else None
+                if committed is None:
+                    consumer.seek_to_beginning(tp)
+                else:
+                    consumer.seek(tp, committed)
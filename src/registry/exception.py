@@ -12,3 +12,16 @@ class FlagNotFound(ExperimentRegistryException):
     def __init__(self, message=None):
         self.message = message
         super().__init__(message)
+
+
+class DataPublishFailed(ExperimentRegistryException):
+    def __init__(self, message=None, errors=None):
+        self.message = message
+        self.errors = errors or []
+        super().__init__(message)
+
+
+class DataLoadTimeout(ExperimentRegistryException):
+    def __init__(self, message=None):
+        self.message = message
+        super().__init__(message)
@@ -1,21 +1,51 @@
-from sqlalchemy import Column, Integer, String, LargeBinary, DateTime, func
+from contextlib import contextmanager
+from typing import Iterator
+
+from sqlalchemy import Column, Integer, BigInteger, String, LargeBinary, DateTime, ForeignKey, func
 from sqlalchemy import Index
 from sqlalchemy import create_engine
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, deferred, Session
+
+from src.registry.config import POSTGRES_POOL_SIZE, POSTGRES_MAX_OVERFLOW, POSTGRES_POOL_TIMEOUT, \
+    POSTGRES_POOL_RECYCLE
 
 Base = declarative_base()
 
 
 class PostgresConnector():
-    def __init__(self, database_url: str):
-        self.engine = create_engine(database_url)
-        self.Session = sessionmaker(bind=self.engine)
+    def __init__(self, database_url: str, pool_size: int = POSTGRES_POOL_SIZE,
+                 max_overflow: int = POSTGRES_MAX_OVERFLOW, pool_timeout: float = POSTGRES_POOL_TIMEOUT,
+                 pool_recycle: int = POSTGRES_POOL_RECYCLE, pool_pre_ping: bool = True):
+        """
+        pool_size connections are kept open, up to max_overflow more are opened under load. pool_pre_ping checks
+        a connection before handing it out and pool_recycle replaces connections older than that many seconds.
+        """
+        self.engine = create_engine(database_url, pool_size=pool_size, max_overflow=max_overflow,
+                                    pool_timeout=pool_timeout, pool_recycle=pool_recycle, pool_pre_ping=pool_pre_ping)
+        # Loaded rows stay usable after the session is closed
+        self.Session = sessionmaker(bind=self.engine, expire_on_commit=False)
 
     def get_session(self):
         return self.Session()
 
+    @contextmanager
+    def session_scope(self) -> Iterator[Session]:
+        """
+        One session per call, committed on success and rolled back on error. Sessions are not thread-safe,
+        scoping them per call lets the loader and serving threads share the connector.
+        """
+        session = self.Session()
+        try:
+            yield session
+            session.commit()
+        except BaseException:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
     def create_tables(self):
         Base.metadata.create_all(self.engine)
 
@@ -28,11 +58,37 @@ class ModelMetadata(Base):
     experiments = Column(JSONB, nullable=False)
     flag = Column(String, nullable=True)
     version = Column(Integer, nullable=True)
-    model_data = Column(LargeBinary, nullable=False)
+    # Kept for rows registered before blobs were deduplicated, new rows reference ModelBlob by content_hash.
+    # Deferred so metadata queries never read the blob
+    model_data = deferred(Column(LargeBinary, nullable=True))
+    model_format = Column(String, nullable=False, server_default='pickle')
+    content_hash = Column(String, nullable=True)
+    size = Column(BigInteger, nullable=True)
     updated_at = Column(DateTime(timezone=True), server_default=func.now())
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     __table_args__ = (
-        Index('idx_name_experiment', 'name', 'experiment'),  # Index for name and experiment
-        Index('idx_name_experiment_version', 'name', 'expertise', 'version'),  # Index for name, experiment, and Vegan
+        Index('idx_content_hash', 'content_hash'),
+        Index('idx_flag_name_version', flag, name, version.desc()),  # Latest version lookups
+        Index('idx_experiments', experiments, postgresql_using='gin'),  # experiments @> '["experiment"]'
     )
+
+
+class ModelBlob(Base):
+    """
+    Serialized models stored once per sha256 of their bytes, the bytes are split in ModelBlobChunk rows.
+    """
+    __tablename__ = 'model_blob'
+
+    content_hash = Column(String, primary_key=True)
+    size = Column(BigInteger, nullable=False)
+    chunk_count = Column(Integer, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class ModelBlobChunk(Base):
+    __tablename__ = 'model_blob_chunk'
+
+    content_hash = Column(String, ForeignKey('model_blob.content_hash', ondelete='CASCADE'), primary_key=True)
+    chunk_index = Column(Integer, primary_key=True)
+    data = Column(LargeBinary, nullable=False)
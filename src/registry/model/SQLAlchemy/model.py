@@ -1,44 +1,68 @@
-import pickle
+import io
+import tempfile
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Iterator
+
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
 
 from experiment.base import AiModel
+from src.registry.config import MODEL_CHUNK_SIZE_BYTES
 from src.registry.exception import ModelNotFound
-from src.registry.model.SQLAlchemy.connector import PostgresConnector, ModelMetadata
+from src.registry.model.SQLAlchemy.connector import PostgresConnector, ModelMetadata, ModelBlob, ModelBlobChunk
 from src.registry.model.base import ModelRegistryInterface, ExperimentModel
+from src.registry.model.compression import HashingWriter
+from src.registry.model.local_store import LocalModelStore
+from src.registry.model.model_cache import ModelCache
+from src.registry.model.serializer import ModelSerializerInterface, PickleSerializer, get_serializer
 
 
 class PostgresModelRegistry(ModelRegistryInterface):
-    def __init__(self, postgres_connector: PostgresConnector):
-        self.session = postgres_connector.get_session()
+    def __init__(self, postgres_connector: PostgresConnector, serializer: Optional[ModelSerializerInterface] = None,
+                 local_store: Optional[LocalModelStore] = None, model_cache: Optional[ModelCache] = None,
+                 chunk_size_bytes: int = MODEL_CHUNK_SIZE_BYTES):
+        """
+        Pass the ModelCache used for serving as model_cache to reuse loaded objects with the same content hash.
+        Serialized models are stored and streamed back in chunks of chunk_size_bytes.
+        """
+        self.postgres_connector = postgres_connector
         postgres_connector.create_tables()  # Ensure tables are created
+        self.serializer = serializer or PickleSerializer()
+        self.local_store = local_store
+        self.model_cache = model_cache
+        self.chunk_size_bytes = chunk_size_bytes
 
-    def register(self, model, model_name: str, flag: str, experiments: List[str], version: Optional[int] = None) -> int:
+    def register(self, model, model_name: str, flag: str, experiments: List[str], version: Optional[int] = None,
+                 serializer: Optional[ModelSerializerInterface] = None) -> int:
         """
         Register a new model or create a new version in PostgreSQL.
         """
         current_time = datetime.utcnow()
-        model_data = pickle.dumps(model)
-        new_model = ModelMetadata(
-            name=model_name,
-            flag=flag,
-            experiments=experiments,
-            model_data=model_data,
-            updated_at=current_time,
-        )
-
-        if version is None:
-            try:
-                last_version = self.get_last_version(flag=flag) + 1
-                new_model.version = last_version
-            except ModelNotFound:
-                new_model.version = self.STARTING_VERSION
-                new_model.created_at = current_time
-        else:
-            new_model.version = version
-
-        self.session.add(new_model)
-        self.session.commit()
+        serializer = serializer or self.serializer
+        with self.postgres_connector.session_scope() as session:
+            content_hash, size = self._store_blob(session, model, serializer)
+            new_model = ModelMetadata(
+                name=model_name,
+                flag=flag,
+                experiments=experiments,
+                model_format=serializer.format,
+                content_hash=content_hash,
+                size=size,
+                updated_at=current_time,
+            )
+
+            if version is None:
+                try:
+                    last_version = self._get_last_version(session, flag=flag) + 1
+                    new_model.version = last_version
+                except ModelNotFound:
+                    new_model.version = self.STARTING_VERSION
+                    new_model.created_at = current_time
+            else:
+                new_model.version = version
+
+            session.add(new_model)
 
         return new_model.version
 
@@ -47,7 +71,12 @@ class PostgresModelRegistry(ModelRegistryInterface):
         """
         Load the model using model_name, experiment, and version. If the version is None, the latest is assumed.
         """
-        query = self.session.query(ModelMetadata).filter(ModelMetadata.flag == flag)
+        with self.postgres_connector.session_scope() as session:
+            return self._load(session, flag=flag, experiment=experiment, model_name=model_name, version=version)
+
+    def _load(self, session: Session, flag: str, experiment: Optional[str], model_name: Optional[str],
+              version: Optional[int]) -> ExperimentModel:
+        query = session.query(ModelMetadata).filter(ModelMetadata.flag == flag)
 
         if experiment:
             query = query.filter(ModelMetadata.experiments.contains([experiment]))
@@ -65,44 +94,114 @@ class PostgresModelRegistry(ModelRegistryInterface):
         if model is None:
             raise ModelNotFound(
                 f"No model found for {model_name} under experiment {experiment} with version {version}")
+
+        def fetch_model():
+            if model.content_hash is not None and self._has_chunks(session, model.content_hash):
+                return get_serializer(model.model_format).load(self._open_blob(session, model.content_hash))
+            # Registered before blobs were chunked, content_hash may be set but the bytes are in model_data
+            if model.model_data is None:
+                raise ModelNotFound(f"No stored data for model {model.name} version {model.version}")
+            return get_serializer(model.model_format).loads(model.model_data)
+
+        # Same content already deserialized for another name or version
+        loaded_model = self.model_cache.get_by_digest(model.content_hash) if self.model_cache is not None else None
+        if loaded_model is None:
+            if self.local_store is not None and self.local_store.supports(model.model_format):
+                loaded_model = self.local_store.get_or_fetch(flag=model.flag, model_name=model.name,
+                                                             version=model.version, content_hash=model.content_hash,
+                                                             fetch=fetch_model)
+            else:
+                loaded_model = fetch_model()
+
+        size = model.size
+        if size is None:
+            # Registered before the size was recorded, measure model_data in the database
+            size = session.query(func.octet_length(ModelMetadata.model_data)) \
+                .filter(ModelMetadata.id == model.id).scalar()
         return ExperimentModel(
-            model=pickle.loads(model.model_data),
+            model=loaded_model,
             model_name=model.name,
             version=model.version,
             experiment=experiment,
             updated_at=model.updated_at,
             flag=model.flag,
+            size_bytes=size or 0,
+            content_hash=model.content_hash,
         )
 
-    def update(self, model_name: str, flag: str, experiments: List[str], version: int) -> None:
-        model_record = self.session.query(ModelMetadata).filter(
-            ModelMetadata.name == model_name,
-            ModelMetadata.flag == flag,
-            ModelMetadata.version == version
-        ).first()
-
-        if not model_record:
-            raise ModelNotFound(f"Model {model_name} with flag {flag} and version {version} not found.")
-
-        # Extend the current experiments list with new experiments avoiding duplicates
-        if model_record.experiments is not None:
-            updated_experiments = list(set(model_record.experiments + experiments))
-        else:
-            updated_experiments = experiments
-
-        # Update the experiments field and modified timestamp
-        model_record.experiments = updated_experiments
-        model_record.updated_at = datetime.utcnow()
+    def _store_blob(self, session: Session, model, serializer: ModelSerializerInterface):
+        """
+        Serialize into a spooled temporary file while hashing, then insert the chunks unless a blob with the same
+        content hash is already stored. Returns the content hash and size of the serialized model.
+        """
+        with tempfile.SpooledTemporaryFile(max_size=self.chunk_size_bytes) as spool:
+            hashing_writer = HashingWriter(spool)
+            serializer.dump(model, hashing_writer)
+            content_hash, size = hashing_writer.hexdigest(), hashing_writer.size
+
+            if session.query(ModelBlob.content_hash).filter(ModelBlob.content_hash == content_hash).first():
+                return content_hash, size
+            chunk_count = -(-size // self.chunk_size_bytes)
+            inserted = session.execute(
+                insert(ModelBlob).values(content_hash=content_hash, size=size, chunk_count=chunk_count)
+                .on_conflict_do_nothing(index_elements=[ModelBlob.content_hash]))
+            if inserted.rowcount == 0:
+                return content_hash, size
+
+            spool.seek(0)
+            for chunk_index in range(chunk_count):
+                session.execute(insert(ModelBlobChunk).values(content_hash=content_hash, chunk_index=chunk_index,
+                                                              data=spool.read(self.chunk_size_bytes)))
+        return content_hash, size
+
+    @staticmethod
+    def _has_chunks(session: Session, content_hash: str) -> bool:
+        return session.query(ModelBlobChunk.chunk_index) \
+            .filter(ModelBlobChunk.content_hash == content_hash) \
+            .limit(1).first() is not None
+
+    def _open_blob(self, session: Session, content_hash: str) -> io.BufferedReader:
+        """
+        Readable stream over the blob chunks, rows are fetched from a server side cursor as they are read.
+        """
+        chunks = session.query(ModelBlobChunk.data) \
+            .filter(ModelBlobChunk.content_hash == content_hash) \
+            .order_by(ModelBlobChunk.chunk_index) \
+            .yield_per(1)
+        return io.BufferedReader(_ChunkReader(data for data, in chunks), buffer_size=self.chunk_size_bytes)
 
-        # Commit transaction
-        self.session.commit()
+    def update(self, model_name: str, flag: str, experiments: List[str], version: int) -> None:
+        with self.postgres_connector.session_scope() as session:
+            model_record = session.query(ModelMetadata).filter(
+                ModelMetadata.name == model_name,
+                ModelMetadata.flag == flag,
+                ModelMetadata.version == version
+            ).with_for_update().first()
+
+            if not model_record:
+                raise ModelNotFound(f"Model {model_name} with flag {flag} and version {version} not found.")
+
+            # Extend the current experiments list with new experiments avoiding duplicates
+            if model_record.experiments is not None:
+                updated_experiments = list(set(model_record.experiments + experiments))
+            else:
+                updated_experiments = experiments
+
+            # Update the experiments field and modified timestamp
+            model_record.experiments = updated_experiments
+            model_record.updated_at = datetime.utcnow()
 
     def get_last_version(self, flag: str, model_name: str = None, experiment: Optional[str] = None) -> int:
         """
         Retrieve the latest version number of a model given its name and experiment.
         """
+        with self.postgres_connector.session_scope() as session:
+            return self._get_last_version(session, flag=flag, model_name=model_name, experiment=experiment)
 
-        query = self.session.query(ModelMetadata.version).filter(ModelMetadata.flag == flag)
+    @staticmethod
+    def _get_last_version(session: Session, flag: str, model_name: str = None,
+                          experiment: Optional[str] = None) -> int:
+        query = session.query(ModelMetadata.version).filter(ModelMetadata.flag == flag)
 
         if model_name:
             query = query.filter(ModelMetadata.name == model_name)
@@ -110,9 +209,9 @@ class PostgresModelRegistry(ModelRegistryInterface):
         if experiment:
             query = query.filter(ModelMetadata.experiments.contains([experiment]))
 
-        latest_version = query.order_by(ModelMetadata.version.desc()).one_or_none()
+        latest_version = query.order_by(ModelMetadata.version.desc()).limit(1).scalar()
 
-        if not latest_version:
+        if latest_version is None:
             raise ModelNotFound(f"No versions found for model {model_name} under flag {flag}")
         return latest_version
 
@@ -122,9 +221,30 @@ class PostgresModelRegistry(ModelRegistryInterface):
         """
         query = (ModelMetadata.name, ModelMetadata.version)
 
-        models = self.session.query(*query).filter(ModelMetadata.flag.is_(flag)) \
-            .order_by(ModelMetadata.version).all()
+        with self.postgres_connector.session_scope() as session:
+            models = session.query(*query).filter(ModelMetadata.flag == flag) \
+                .order_by(ModelMetadata.version).all()
         if not models:
             raise ModelNotFound(f"No versions found under flag {flag}")
 
         return [AiModel(name=name, version=version) for name, version in models]
+
+
+class _ChunkReader(io.RawIOBase):
+    def __init__(self, chunks: Iterator[bytes]):
+        self._chunks = chunks
+        self._current = memoryview(b'')
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._current:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._current = memoryview(chunk)
+        size = min(len(buffer), len(self._current))
+        buffer[:size] = self._current[:size]
+        self._current = self._current[size:]
+        return size
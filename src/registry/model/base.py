@@ -1,11 +1,20 @@
+import logging
+import threading
 from abc import ABC, abstractmethod
-from dataclasses import dataclass, field
+from concurrent.futures import Executor, Future
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Callable, Dict, Tuple, TYPE_CHECKING
 
 from apscheduler.schedulers.background import BackgroundScheduler
 
 from src.experiment.base import AiModel
+from src.registry.exception import ModelNotFound
+
+if TYPE_CHECKING:
+    from src.registry.model.serializer import ModelSerializerInterface
+
+logger = logging.getLogger(__name__)
 
 
 @dataclass
@@ -16,49 +25,115 @@ class ExperimentModel:
     experiment: Optional[str]
     flag: str
     updated_at: datetime
+    size_bytes: int = 0
+    content_hash: Optional[str] = None
+
+
+class ModelSlot:
+    """
+    Holds the live version of a model. The next version is loaded (and optionally warmed up) on a worker
+    thread, then swapped in with a single reference assignment: in-flight requests finish on the model they
+    already hold and the first requests on the new version don't pay the cold start.
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self._current: Optional[ExperimentModel] = None
+        self._loading_version: Optional[int] = None
+        self._requested_version: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @property
+    def current(self) -> Optional[ExperimentModel]:
+        return self._current
+
+    def swap(self, experiment_model: ExperimentModel):
+        self._current = experiment_model
+
+    def prefetch(self, version: Optional[int], loader: Callable[[], ExperimentModel], executor: Executor,
+                 warm_up: Optional[Callable[[ExperimentModel], None]] = None) -> Optional[Future]:
+        """
+        Load the version in the background unless it is already live or being loaded. The last requested
+        version wins: a slower load of an earlier request is not swapped in over it, whichever is newer, as
+        a model may be pinned back to an older version.
+        """
+        with self._lock:
+            current = self._current
+            self._requested_version = version
+            if version is not None and current is not None and current.version == version:
+                return None
+            if version is not None and version == self._loading_version:
+                return None
+            self._loading_version = version
+        return executor.submit(self._load_and_swap, version, loader, warm_up)
+
+    def _load_and_swap(self, version: Optional[int], loader: Callable[[], ExperimentModel],
+                       warm_up: Optional[Callable[[ExperimentModel], None]]):
+        try:
+            experiment_model = loader()
+            if warm_up is not None:
+                warm_up(experiment_model)
+            with self._lock:
+                if self._requested_version != version:
+                    logger.info("Version %s of model slot %s is loaded but version %s was requested since, "
+                                "not swapping it in", version, self.key, self._requested_version)
+                    return experiment_model
+                self.swap(experiment_model)
+            return experiment_model
+        except Exception:
+            logger.exception("Loading version %s of model slot %s failed", version, self.key)
+            raise
+        finally:
+            with self._lock:
+                if self._loading_version == version:
+                    self._loading_version = None
 
 
-@dataclass
 class ExperimentModelSingleton:
-    experiment_model: ExperimentModel = None
-    _instances: dict = field(default_factory=dict, init=False, repr=False)
-
-    def __new__(cls, experiment_model: ExperimentModel):
-        key = experiment_model.experiment or experiment_model.flag
-        if experiment_model.experiment not in cls._instances:
-            instance = super().__new__(cls)
-            instance.experiment_model = experiment_model
-            instance._is_initialized = False
-            cls._instances[key] = instance
-        return cls._instances[key]
+    """
+    Process wide model slots, keyed by experiment or by flag for the flag level models.
+    """
+    _slots: Dict[str, ModelSlot] = {}
+    _slots_lock = threading.Lock()
 
     def __init__(self, experiment_model: ExperimentModel):
-        if not self._is_initialized:
-            self.experiment_model = experiment_model
-            self._is_initialized = True
+        self.experiment_model = experiment_model
+        self.get_slot(self.get_key(experiment_model.flag, experiment_model.experiment)).swap(experiment_model)
+
+    @staticmethod
+    def get_key(flag: str, experiment: Optional[str] = None) -> str:
+        return experiment or flag
 
     @classmethod
-    def get_instance(cls, experiment: str) -> ExperimentModel:
-        cls._ensure_instances_initialized()
-        experiment_model_singleton = cls._instances.get(experiment, None)
-        if experiment_model_singleton:
-            return experiment_model_singleton.experiment_model
+    def get_slot(cls, key: str) -> ModelSlot:
+        slot = cls._slots.get(key)
+        if slot is None:
+            with cls._slots_lock:
+                slot = cls._slots.setdefault(key, ModelSlot(key))
+        return slot
 
     @classmethod
-    def _ensure_instances_initialized(cls):
-        if '_instances' not in cls.__dict__:
-            cls._instances = {}
+    def get_instance(cls, experiment: str) -> Optional[ExperimentModel]:
+        slot = cls._slots.get(experiment)
+        if slot:
+            return slot.current
+        return None
 
     @classmethod
     def clear_instances(cls):
-        cls._instances.clear()
+        with cls._slots_lock:
+            cls._slots.clear()
 
 
 class ModelRegistryInterface(ABC):
     STARTING_VERSION = 1
 
     @abstractmethod
-    def register(self, model, model_name: str, flag: str, experiments: List[str], version: Optional[int] = None) -> int:
+    def register(self, model, model_name: str, flag: str, experiments: List[str], version: Optional[int] = None,
+                 serializer: Optional['ModelSerializerInterface'] = None) -> int:
+        """
+        serializer overrides the registry default for this model, its format is recorded with the model.
+        """
         pass
 
     @abstractmethod
@@ -78,6 +153,47 @@ class ModelRegistryInterface(ABC):
     def get_all_flag_models_specifications(self, flag: str) -> List[AiModel]:
         pass
 
+    def get_last_versions(self, models: List[Tuple[str, Optional[str], Optional[str]]]
+                          ) -> Dict[Tuple[str, Optional[str], Optional[str]], int]:
+        """
+        Latest version of each (flag, model_name, experiment), models without any version are left out.
+        Registries that can answer in one query override this.
+        """
+        last_versions = {}
+        for flag, model_name, experiment in models:
+            try:
+                last_versions[(flag, model_name, experiment)] = self.get_last_version(
+                    flag=flag, model_name=model_name, experiment=experiment)
+            except ModelNotFound:
+                pass
+        return last_versions
+
+
+@dataclass
+class ModelVersionEvent:
+    flag: str
+    model_name: str
+    version: int
+    experiments: List[str]
+
+
+class ModelVersionNotifierInterface(ABC):
+    @abstractmethod
+    def publish(self, event: ModelVersionEvent) -> None:
+        pass
+
+    @abstractmethod
+    def subscribe(self, callback: Callable[[ModelVersionEvent], None],
+                  on_reconnect: Optional[Callable[[], None]] = None) -> None:
+        """
+        on_reconnect is called after the subscription recovered from an error, events may have been missed.
+        """
+        pass
+
+    @abstractmethod
+    def close(self) -> None:
+        pass
+
 
 class ModelLoaderInterface(ABC):
 
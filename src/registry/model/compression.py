@@ -0,0 +1,104 @@
+import hashlib
+import importlib
+import io
+from typing import BinaryIO, Optional
+
+from src.registry.exception import ExperimentRegistryException
+
+COMPRESSION_CODECS = ('zstd', 'lz4')
+
+
+class HashingWriter(io.RawIOBase):
+    """
+    Pass-through writer that keeps the sha256 and size of everything written through it.
+    """
+
+    def __init__(self, file: BinaryIO):
+        self.file = file
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        data = memoryview(data)
+        self.digest.update(data)
+        self.size += data.nbytes
+        self.file.write(data)
+        return data.nbytes
+
+    def hexdigest(self) -> str:
+        return self.digest.hexdigest()
+
+
+def check_codec(codec: Optional[str]):
+    """
+    Fail early, e.g. when a registry is created, if codec is unknown or its library is not installed.
+    """
+    if codec is None:
+        return
+    if codec not in COMPRESSION_CODECS:
+        raise ExperimentRegistryException(f"Unknown model compression {codec}")
+    module = 'zstandard' if codec == 'zstd' else 'lz4.frame'
+    try:
+        importlib.import_module(module)
+    except ImportError as ex:
+        raise ImportError(f"{module.split('.')[0]} is required for {codec} model compression") from ex
+
+
+def compress_writer(file: BinaryIO, codec: Optional[str], level: Optional[int] = None) -> BinaryIO:
+    """
+    Wrap file so everything written is compressed with codec, close the returned writer to flush the frame.
+    file itself is left open.
+    """
+    if codec is None:
+        return _UnclosedWriter(file)
+    if codec == 'zstd':
+        try:
+            import zstandard
+        except ImportError as ex:
+            raise ImportError("zstandard is required for zstd model compression") from ex
+        return zstandard.ZstdCompressor(level=3 if level is None else level).stream_writer(file, closefd=False)
+    if codec == 'lz4':
+        try:
+            import lz4.frame
+        except ImportError as ex:
+            raise ImportError("lz4 is required for lz4 model compression") from ex
+        # LZ4FrameFile does not close a file object it didn't open
+        return lz4.frame.LZ4FrameFile(file, mode='wb', compression_level=0 if level is None else level)
+    raise ExperimentRegistryException(f"Unknown model compression {codec}")
+
+
+def decompress_reader(file: BinaryIO, codec: Optional[str]) -> BinaryIO:
+    """
+    Streaming decompression of file, the result supports read, readline and peek as pickle and joblib expect.
+    """
+    if codec is None:
+        return file
+    if codec == 'zstd':
+        try:
+            import zstandard
+        except ImportError as ex:
+            raise ImportError("zstandard is required for zstd model compression") from ex
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(file, closefd=False))
+    if codec == 'lz4':
+        try:
+            import lz4.frame
+        except ImportError as ex:
+            raise ImportError("lz4 is required for lz4 model compression") from ex
+        return lz4.frame.LZ4FrameFile(file, mode='rb')
+    raise ExperimentRegistryException(f"Unknown model compression {codec}")
+
+
+class _UnclosedWriter(io.RawIOBase):
+    def __init__(self, file: BinaryIO):
+        self.file = file
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        data = memoryview(data)
+        self.file.write(data)
+        return data.nbytes
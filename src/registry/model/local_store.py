@@ -0,0 +1,116 @@
+import fcntl
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Optional, Set, Tuple
+from urllib.parse import quote
+
+import joblib
+
+from src.registry.config import LOCAL_MODEL_STORE_DIR
+
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class LocalModelStore:
+    """
+    Host-wide on-disk cache of registered models keyed by (flag, model_name, version).
+    Models are written once per host as uncompressed joblib files and loaded with mmap_mode='r', so the numpy
+    buffers of a model are shared pages between every worker process of the host instead of private copies.
+    """
+    MMAP_FORMATS = ('pickle', 'joblib', 'joblib-mmap', 'skops')
+
+    def __init__(self, directory: str = LOCAL_MODEL_STORE_DIR):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._verified_files: Set[Tuple[Path, str]] = set()
+        self._verified_lock = threading.Lock()
+
+    def supports(self, model_format: Optional[str]) -> bool:
+        return (model_format or 'pickle') in self.MMAP_FORMATS
+
+    def get_or_fetch(self, flag: str, model_name: str, version: int, content_hash: Optional[str],
+                     fetch: Callable[[], object]):
+        """
+        Return the memory-mapped model, fetch (download and deserialize) runs only if this host has no valid copy.
+        """
+        path = self._get_path(flag, model_name, version)
+        if self._is_valid(path, content_hash):
+            return joblib.load(path, mmap_mode='r')
+
+        with self._lock(path):
+            # Another process may have written the model while we were waiting for the lock
+            if not self._is_valid(path, content_hash):
+                self._write(path, content_hash, fetch())
+        return joblib.load(path, mmap_mode='r')
+
+    def _get_path(self, flag: str, model_name: str, version: int) -> Path:
+        return self.directory / quote(flag, safe='') / quote(str(model_name), safe='') / f"{version}.joblib"
+
+    @staticmethod
+    def _get_metadata_path(path: Path) -> Path:
+        return path.with_suffix('.json')
+
+    def _is_valid(self, path: Path, content_hash: Optional[str]) -> bool:
+        """
+        The registry content hash must match, the file itself is re-hashed once per process.
+        """
+        try:
+            metadata = json.loads(self._get_metadata_path(path).read_text())
+        except FileNotFoundError:
+            return False
+        if content_hash is not None and metadata.get('content_hash') != content_hash:
+            return False
+        # Verified per (path, file hash), a rewritten model is re-hashed even if its path was verified before
+        verified_file = (path, metadata.get('file_sha256'))
+        with self._verified_lock:
+            if verified_file in self._verified_files:
+                return True
+        if not path.exists() or self._hash_file(path) != verified_file[1]:
+            return False
+        with self._verified_lock:
+            self._verified_files.add(verified_file)
+        return True
+
+    def _write(self, path: Path, content_hash: Optional[str], model):
+        """
+        Both files are replaced atomically, the metadata first: a reader pairing the new metadata with the old
+        model file fails the file hash check and waits for the lock instead of loading a mismatched model.
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = path.with_suffix(f'.{os.getpid()}.tmp')
+        joblib.dump(model, temporary_path, compress=0)
+        file_sha256 = self._hash_file(temporary_path)
+
+        metadata_path = self._get_metadata_path(path)
+        temporary_metadata_path = metadata_path.with_suffix(f'.{os.getpid()}.json.tmp')
+        temporary_metadata_path.write_text(json.dumps({'content_hash': content_hash, 'file_sha256': file_sha256}))
+        os.replace(temporary_metadata_path, metadata_path)
+        os.replace(temporary_path, path)
+        with self._verified_lock:
+            self._verified_files.add((path, file_sha256))
+
+    @staticmethod
+    def _hash_file(path: Path) -> str:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(_HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    @contextmanager
+    def _lock(path: Path):
+        """
+        Exclusive inter-process lock on the model path, held while the model is downloaded and written.
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path.with_suffix('.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,189 @@
+import dataclasses
+import pickle
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+from cachetools import TTLCache, LRUCache
+
+from src.registry.config import MODEL_CACHE_MAX_BYTES, MODEL_LATEST_VERSION_TTL, MODEL_METADATA_CACHE_SIZE
+from src.registry.model.base import ExperimentModel, ModelRegistryInterface
+
+
+class _PendingLoad:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result: Optional[ExperimentModel] = None
+        self.error: Optional[BaseException] = None
+
+
+class ModelCache:
+    """
+    Thread-safe LRU of deserialized models keyed by (flag, model_name, version), evicted by size in bytes.
+    Concurrent misses on the same key load the model once. Models are also indexed by content hash so registries
+    can reuse an already deserialized object registered under another name or version.
+    Latest versions are cached for latest_version_ttl seconds.
+    """
+
+    def __init__(self, max_bytes: int = MODEL_CACHE_MAX_BYTES, latest_version_ttl: float = MODEL_LATEST_VERSION_TTL,
+                 latest_version_cache_size: int = MODEL_METADATA_CACHE_SIZE):
+        self.max_bytes = max_bytes
+        self._models: 'OrderedDict[Hashable, Tuple[ExperimentModel, int]]' = OrderedDict()
+        self._pending: Dict[Hashable, _PendingLoad] = {}
+        self._digests: Dict[str, Hashable] = {}
+        self._latest_versions = TTLCache(maxsize=latest_version_cache_size, ttl=latest_version_ttl)
+        # (flag, experiment, version) -> the model name the registry resolved it to
+        self._resolved_names = LRUCache(maxsize=latest_version_cache_size)
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def load(self, model_registry: ModelRegistryInterface, flag: str, experiment: str = None,
+             model_name: Optional[str] = None, version: Optional[int] = None) -> ExperimentModel:
+        """
+        Cached ModelRegistryInterface.load, the latest version is resolved with a cached metadata-only query.
+        Without model_name the registry picks the experiment's model, the entry is keyed by the name it resolves to.
+        """
+        if version is None:
+            version = self.get_last_version(model_registry, flag=flag, model_name=model_name, experiment=experiment)
+
+        def loader() -> ExperimentModel:
+            return model_registry.load(flag=flag, experiment=experiment, model_name=model_name, version=version)
+
+        resolved_name = model_name
+        if model_name is None:
+            with self._lock:
+                resolved_name = self._resolved_names.get((flag, experiment, version))
+        if resolved_name is not None:
+            experiment_model = self.get_or_load((flag, resolved_name, version), loader)
+        else:
+            experiment_model = self.get_or_load(('resolve', flag, experiment, version), loader,
+                                                key_of=lambda loaded: (flag, loaded.model_name, version))
+            with self._lock:
+                self._resolved_names[(flag, experiment, version)] = experiment_model.model_name
+        if experiment_model.experiment != experiment:
+            experiment_model = dataclasses.replace(experiment_model, experiment=experiment)
+        return experiment_model
+
+    def get_last_version(self, model_registry: ModelRegistryInterface, flag: str, model_name: Optional[str] = None,
+                         experiment: Optional[str] = None) -> int:
+        key = (flag, model_name, experiment)
+        with self._lock:
+            version = self._latest_versions.get(key)
+        if version is None:
+            version = model_registry.get_last_version(flag=flag, model_name=model_name, experiment=experiment)
+            with self._lock:
+                self._latest_versions[key] = version
+        return version
+
+    def invalidate_latest_versions(self, flag: str):
+        """
+        Forget the cached latest versions and resolved model names of the flag, e.g. after registering a new
+        version.
+        """
+        with self._lock:
+            for cache in (self._latest_versions, self._resolved_names):
+                for key in [key for key in cache.keys() if key[0] == flag]:
+                    cache.pop(key, None)
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], ExperimentModel],
+                    key_of: Optional[Callable[[ExperimentModel], Hashable]] = None) -> ExperimentModel:
+        """
+        Cached loader(), concurrent misses on key share one load. key_of gives the key the loaded model is stored
+        under when it differs from the lookup key.
+        """
+        with self._lock:
+            cached = self._models.get(key)
+            if cached is not None:
+                self._models.move_to_end(key)
+                self.hits += 1
+                return cached[0]
+            pending = self._pending.get(key)
+            is_loader = pending is None
+            if is_loader:
+                pending = _PendingLoad()
+                self._pending[key] = pending
+                self.misses += 1
+
+        if not is_loader:
+            pending.event.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.result
+
+        try:
+            pending.result = loader()
+            self._put(key if key_of is None else key_of(pending.result), pending.result)
+            return pending.result
+        except BaseException as ex:
+            pending.error = ex
+            raise
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+            pending.event.set()
+
+    def get_by_digest(self, content_hash: Optional[str]) -> Optional[object]:
+        """
+        The deserialized model with this content hash if any cached entry holds it.
+        """
+        if content_hash is None:
+            return None
+        with self._lock:
+            key = self._digests.get(content_hash)
+            cached = self._models.get(key) if key is not None else None
+            if cached is None:
+                return None
+            self._models.move_to_end(key)
+            return cached[0].model
+
+    def _put(self, key: Hashable, experiment_model: ExperimentModel):
+        size = experiment_model.size_bytes or len(pickle.dumps(experiment_model.model, pickle.HIGHEST_PROTOCOL))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._models.pop(key, None)
+            if previous is not None:
+                self._size -= previous[1]
+                self._forget_digest(key, previous[0])
+            self._models[key] = (experiment_model, size)
+            self._size += size
+            if experiment_model.content_hash is not None:
+                self._digests[experiment_model.content_hash] = key
+            while self._size > self.max_bytes:
+                evicted_key, (evicted_model, evicted_size) = self._models.popitem(last=False)
+                self._size -= evicted_size
+                self._forget_digest(evicted_key, evicted_model)
+                self.evictions += 1
+
+    def _forget_digest(self, key: Hashable, experiment_model: ExperimentModel):
+        if self._digests.get(experiment_model.content_hash) == key:
+            del self._digests[experiment_model.content_hash]
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            cached = self._models.pop(key, None)
+            if cached is not None:
+                self._size -= cached[1]
+                self._forget_digest(key, cached[0])
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+            self._digests.clear()
+            self._latest_versions.clear()
+            self._resolved_names.clear()
+            self._size = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'models': len(self._models),
+                'size_bytes': self._size,
+                'max_bytes': self.max_bytes,
+            }
@@ -0,0 +1,77 @@
+import logging
+from datetime import datetime
+from typing import List, Tuple, Optional, Callable
+
+from src.experiment.experiment_manager import ExperimentManager
+from src.registry.config import MODEL_RECONCILE_INTERVAL
+from src.registry.model.base import ModelRegistryInterface, ModelVersionNotifierInterface, ModelVersionEvent, \
+    ExperimentModel
+from src.registry.model.model_loader.scheduler import ModelLoader
+
+logger = logging.getLogger(__name__)
+
+
+class EventDrivenModelLoader(ModelLoader):
+    """
+    Loads new model versions when ExperimentManager.register_ai_model announces them, or when a flag or
+    experiment is saved (e.g. an admin pins another ai_model version), instead of polling every model.
+    A single low-frequency job reconciles all the models in case an event was missed, and a reconciliation runs
+    as soon as a broken subscription recovers.
+    """
+
+    def __init__(self, model_registry: ModelRegistryInterface, notifier: ModelVersionNotifierInterface,
+                 reconcile_interval: int = MODEL_RECONCILE_INTERVAL, prefetch_workers: int = 2,
+                 warm_up: Optional[Callable[[ExperimentModel], None]] = None):
+        super().__init__(model_registry, reconcile_interval, prefetch_workers=prefetch_workers, warm_up=warm_up)
+        self.notifier = notifier
+        self._models: List[Tuple[str, str, Optional[str]]] = []
+        self._changes_subscription = None
+
+    def add_scheduler(self, model_name: str, flag: str, experiment: str = None):
+        """
+        Register a model to keep loaded, no polling job is created for it.
+        """
+        self._models.append((model_name, flag, experiment))
+
+    def start_scheduler(self):
+        self.notifier.subscribe(self._on_new_model_version, on_reconnect=self._schedule_reconcile)
+        self._changes_subscription = ExperimentManager.subscribe_changes(self._on_config_changed,
+                                                                         on_reconnect=self._schedule_reconcile)
+        # The first reconciliation runs immediately and loads the current versions
+        self.scheduler.add_job(self._reconcile, 'interval', seconds=self.check_interval,
+                               next_run_time=datetime.now(self.scheduler.timezone))
+        self.scheduler.start()
+
+    def stop_scheduler(self):
+        self.notifier.close()
+        if self._changes_subscription is not None:
+            self._changes_subscription.stop()
+            self._changes_subscription = None
+        self.scheduler.shutdown(wait=False)
+
+    def _on_new_model_version(self, event: ModelVersionEvent):
+        for model_name, flag, experiment in self._models:
+            if flag != event.flag or model_name != event.model_name:
+                continue
+            if experiment is not None and experiment not in event.experiments:
+                continue
+            # Load on the scheduler's pool, the subscription thread only dispatches
+            self.scheduler.add_job(self._monitor_new_model_version, args=[model_name, flag, experiment])
+
+    def _on_config_changed(self, flag_name: str):
+        """
+        A flag or one of its experiments was saved, their ai_model may point to another version now.
+        """
+        for model_name, flag, experiment in self._models:
+            if flag == flag_name:
+                self.scheduler.add_job(self._monitor_new_model_version, args=[model_name, flag, experiment])
+
+    def _schedule_reconcile(self):
+        self.scheduler.add_job(self._reconcile)
+
+    def _reconcile(self):
+        for model_name, flag, experiment in self._models:
+            try:
+                self._monitor_new_model_version(model_name, flag, experiment)
+            except Exception:
+                logger.exception("Reconciling model %s of flag %s failed", model_name, flag)
@@ -0,0 +1,57 @@
+import json
+import logging
+import time
+from typing import Callable, Optional
+
+import redis
+from redis.client import PubSubWorkerThread
+
+from src.registry.config import MODEL_VERSION_CHANNEL
+from src.registry.model.base import ModelVersionNotifierInterface, ModelVersionEvent
+
+logger = logging.getLogger(__name__)
+
+
+class RedisModelVersionNotifier(ModelVersionNotifierInterface):
+    """
+    Publishes new model versions on a Redis pub/sub channel, Redis is already required by the experiment manager.
+    """
+
+    def __init__(self, redis_client: redis.Redis, channel: str = MODEL_VERSION_CHANNEL, poll_interval: float = 0.1):
+        self.redis_client = redis_client
+        self.channel = channel
+        self.poll_interval = poll_interval
+        self._subscription_thread: Optional[PubSubWorkerThread] = None
+
+    def publish(self, event: ModelVersionEvent) -> None:
+        self.redis_client.publish(self.channel, json.dumps({
+            "flag": event.flag,
+            "model_name": event.model_name,
+            "version": event.version,
+            "experiments": event.experiments,
+        }))
+
+    def subscribe(self, callback: Callable[[ModelVersionEvent], None],
+                  on_reconnect: Optional[Callable[[], None]] = None) -> None:
+        def handle_message(message):
+            callback(ModelVersionEvent(**json.loads(message['data'])))
+
+        def handle_error(exception, pubsub, thread):
+            # The pubsub reconnects and resubscribes on its next read, the events published meanwhile are lost
+            logger.warning("Model version subscription failed, resubscribing: %s", exception)
+            time.sleep(self.poll_interval)
+            if on_reconnect is not None:
+                try:
+                    on_reconnect()
+                except Exception:
+                    logger.exception("Model version resubscription callback failed")
+
+        pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{self.channel: handle_message})
+        self._subscription_thread = pubsub.run_in_thread(sleep_time=self.poll_interval, daemon=True,
+                                                         exception_handler=handle_error)
+
+    def close(self) -> None:
+        if self._subscription_thread is not None:
+            self._subscription_thread.stop()
+            self._subscription_thread = None
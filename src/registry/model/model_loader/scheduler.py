@@ -1,11 +1,24 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Optional, Callable
+
 from src.experiment.base import AiModel
-from registry.model.base import ModelRegistryInterface, ModelLoaderInterface, ExperimentModelSingleton
+from registry.model.base import ModelRegistryInterface, ModelLoaderInterface, ExperimentModelSingleton, \
+    ExperimentModel
 from src.experiment.experiment_manager import ExperimentManager
 
 
 class ModelLoader(ModelLoaderInterface):
-    def __init__(self, model_registry: ModelRegistryInterface, check_interval: int):
+    def __init__(self, model_registry: ModelRegistryInterface, check_interval: int, prefetch_workers: int = 2,
+                 warm_up: Optional[Callable[[ExperimentModel], None]] = None):
+        """
+        New versions are loaded on a pool of prefetch_workers threads, warm_up (e.g. a few predictions)
+        runs on the loaded model before it replaces the live version.
+        """
         super().__init__(model_registry, check_interval)
+        self.warm_up = warm_up
+        self._prefetch_executor = ThreadPoolExecutor(max_workers=prefetch_workers,
+                                                     thread_name_prefix='model-prefetch')
 
     def add_scheduler(self, model_name: str, flag: str, experiment: str = None):
         """
@@ -48,10 +61,9 @@ class ModelLoader(ModelLoaderInterface):
         Check the database for a newer version and load it if available.
         """
         latest_version = self.get_last_version(model_name, flag, experiment)
-        experiment_model = ExperimentModelSingleton.get_instance(experiment)
-        need_update_model = (experiment_model and experiment_model.version != latest_version) or (
-                experiment_model is None)
-        if need_update_model:
-            ExperimentModelSingleton(
-                self.model_registry.load(flag=flag, model_name=model_name, experiment=experiment,
-                                         version=latest_version))
+        slot = ExperimentModelSingleton.get_slot(ExperimentModelSingleton.get_key(flag, experiment))
+        slot.prefetch(latest_version,
+                      partial(self.model_registry.load, flag=flag, model_name=model_name, experiment=experiment,
+                              version=latest_version),
+                      self._prefetch_executor,
+                      self.warm_up)
@@ -3,9 +3,16 @@ from pymongo import MongoClient
 
 class MongoDBConnector:
     def __init__(self, host: str, port: int, username: str = None, password: str = None,
-                 db_name: str = "experiment", collection_name: str = "model_registry"):
+                 db_name: str = "experiment", collection_name: str = "model_registry",
+                 blobs_collection_name: str = "model_registry_blobs"):
         self.client = MongoClient(host, port, username=username, password=password)
         self.database = self.client[db_name]
         self.collection = self.client[db_name][collection_name]
+        # Serialized models keyed by their sha256, shared by every version document with the same content
+        self.blobs = self.client[db_name][blobs_collection_name]
         self.collection.create_index([("name", 1), ("experiments", 1)])
         self.collection.create_index([("flag", 1), ("name", 1), ("experiments", 1), ("version", -1)], unique=True)
+        # Covering indexes for the latest version lookups by name and by experiment, and for the flag's versions
+        self.collection.create_index([("flag", 1), ("name", 1), ("version", -1)])
+        self.collection.create_index([("flag", 1), ("experiments", 1), ("version", -1)])
+        self.collection.create_index([("flag", 1), ("version", 1), ("name", 1)])
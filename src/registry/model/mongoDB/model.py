@@ -1,40 +1,82 @@
-import pickle
+import logging
+import shutil
+import tempfile
+import threading
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Tuple, Dict, Hashable, Callable, Any
 
 import gridfs
+from cachetools import TTLCache
+from pymongo.errors import DuplicateKeyError, PyMongoError
 
 from src.experiment.base import AiModel
+from src.registry.config import MODEL_COMPRESSION, MODEL_CHUNK_SIZE_BYTES, MODEL_METADATA_CACHE_TTL, \
+    MODEL_METADATA_CACHE_SIZE
 from src.registry.exception import ModelNotFound
 from src.registry.model.base import ModelRegistryInterface, ExperimentModel
+from src.registry.model.compression import HashingWriter, compress_writer, decompress_reader, check_codec
+from src.registry.model.local_store import LocalModelStore
+from src.registry.model.model_cache import ModelCache
 from src.registry.model.mongoDB.connector import MongoDBConnector
+from src.registry.model.serializer import ModelSerializerInterface, PickleSerializer, get_serializer
+
+logger = logging.getLogger(__name__)
 
 
 class MongoDBModelRegistry(ModelRegistryInterface):
-    def __init__(self, mongo_connector: MongoDBConnector):
+    def __init__(self, mongo_connector: MongoDBConnector, serializer: Optional[ModelSerializerInterface] = None,
+                 local_store: Optional[LocalModelStore] = None, compression: Optional[str] = MODEL_COMPRESSION,
+                 compression_level: Optional[int] = None, chunk_size_bytes: int = MODEL_CHUNK_SIZE_BYTES,
+                 model_cache: Optional[ModelCache] = None, metadata_cache_ttl: float = MODEL_METADATA_CACHE_TTL,
+                 metadata_cache_size: int = MODEL_METADATA_CACHE_SIZE):
+        """
+        compression is None, 'zstd' or 'lz4' (needs the zstandard or lz4 package). Models are streamed into GridFS
+        chunks of chunk_size_bytes, bigger chunks mean fewer chunk documents per model but must stay below the
+        16MB BSON limit.
+        Pass the ModelCache used for serving as model_cache to reuse loaded objects with the same content hash.
+        Metadata reads are cached for metadata_cache_ttl seconds, call watch_changes to invalidate them as soon as
+        the collection changes.
+        """
         self.collection = mongo_connector.collection
+        self.blobs = mongo_connector.blobs
         self.fs = gridfs.GridFS(mongo_connector.database, self.collection.name)
+        self.serializer = serializer or PickleSerializer()
+        self.local_store = local_store
+        check_codec(compression)
+        self.compression = compression
+        self.compression_level = compression_level
+        self.chunk_size_bytes = chunk_size_bytes
+        self.model_cache = model_cache
+        self._metadata_cache = TTLCache(maxsize=metadata_cache_size, ttl=metadata_cache_ttl)
+        self._metadata_lock = threading.Lock()
+        self._change_stream = None
 
-    def register(self, model, model_name: str, flag: str, experiments: List[str], version: Optional[int] = None):
+    def register(self, model, model_name: str, flag: str, experiments: List[str], version: Optional[int] = None,
+                 serializer: Optional[ModelSerializerInterface] = None):
         """
         Register a new model or create a new version in MongoDB.
         """
         current_time = datetime.utcnow()
+        serializer = serializer or self.serializer
 
-        model_data = pickle.dumps(model)
-        file_id = self.fs.put(model_data)
+        blob = self._store_blob(model, serializer)
 
         new_model = {
             "name": model_name,
             "flag": flag,
             "experiments": experiments,
-            "model_file_id": file_id,
+            "model_file_id": blob["file_id"],
+            "model_format": serializer.format,
+            "compression": blob["compression"],
+            "content_hash": blob["_id"],
+            "size": blob["size"],
+            "stored_size": blob["stored_size"],
             "updated_at": current_time,
         }
 
         if version is None:
             try:
-                new_model['version'] = self.get_last_version(flag=flag) + 1
+                new_model['version'] = self._find_last_version(flag=flag) + 1
             except ModelNotFound:
                 new_model['version'] = self.STARTING_VERSION
                 new_model['created_at'] = current_time
@@ -42,6 +84,7 @@ class MongoDBModelRegistry(ModelRegistryInterface):
             new_model['version'] = version
 
         self.collection.insert_one(new_model)
+        self._invalidate_flag(flag)
 
         return new_model['version']
 
@@ -55,6 +98,7 @@ class MongoDBModelRegistry(ModelRegistryInterface):
                 "$set": {"updated_at": datetime.utcnow()},
                 "$addToSet": {"experiments": {"$each": experiments}}
             }, return_document=False)
+        self._invalidate_flag(flag)
 
     def load(self, flag: str, experiment: str = None, model_name: Optional[str] = None,
              version: Optional[int] = None) -> ExperimentModel:
@@ -69,13 +113,36 @@ class MongoDBModelRegistry(ModelRegistryInterface):
         if model_name:
             query["name"] = model_name
 
-        model_document = self.collection.find_one(query, sort=[("version", -1)])
+        model_document = self._cached(('document', flag, experiment, model_name, version),
+                                      lambda: self.collection.find_one(query, sort=[("version", -1)]))
 
         if not model_document:
             raise ModelNotFound(f"No model found for {model_name} under experiment {experiment} with version {version}")
 
-        model_file = self.fs.get(model_document["model_file_id"])
-        model = pickle.loads(model_file.read())
+        model_format = model_document.get("model_format")
+        content_hash = model_document.get('content_hash')
+
+        def fetch_model():
+            return self._read_model_file(model_document["model_file_id"], model_format,
+                                         model_document.get("compression"))
+
+        # Same content already deserialized for another name or version
+        model = self.model_cache.get_by_digest(content_hash) if self.model_cache is not None else None
+        if model is None:
+            if self.local_store is not None and self.local_store.supports(model_format):
+                model = self.local_store.get_or_fetch(flag=model_document['flag'],
+                                                      model_name=model_document['name'],
+                                                      version=model_document['version'],
+                                                      content_hash=content_hash,
+                                                      fetch=fetch_model)
+            else:
+                model = fetch_model()
+
+        size_bytes = model_document.get('size')
+        if size_bytes is None:
+            # Registered before the serialized size was recorded, the GridFS file holds it uncompressed
+            with self.fs.get(model_document["model_file_id"]) as grid_out:
+                size_bytes = grid_out.length
         return ExperimentModel(
             model=model,
             model_name=model_document['name'],
@@ -83,12 +150,98 @@ class MongoDBModelRegistry(ModelRegistryInterface):
             experiment=experiment,
             updated_at=model_document['updated_at'],
             flag=model_document['flag'],
+            size_bytes=size_bytes,
+            content_hash=content_hash,
         )
 
+    def _store_blob(self, model, serializer: ModelSerializerInterface) -> dict:
+        """
+        Store the serialized model once per sha256 of its serialized bytes and return its blob document.
+        The model is serialized into a spooled temporary file first, so an already stored model is never uploaded.
+        """
+        with tempfile.SpooledTemporaryFile(max_size=self.chunk_size_bytes) as spool:
+            compressed = compress_writer(spool, self.compression, self.compression_level)
+            hashing_writer = HashingWriter(compressed)
+            serializer.dump(model, hashing_writer)
+            compressed.close()
+            content_hash = hashing_writer.hexdigest()
+
+            blob = self.blobs.find_one({"_id": content_hash})
+            if blob is not None:
+                return blob
+
+            spool.seek(0)
+            with self.fs.new_file(chunk_size=self.chunk_size_bytes) as grid_in:
+                shutil.copyfileobj(spool, grid_in, self.chunk_size_bytes)
+
+        blob = {
+            "_id": content_hash,
+            "file_id": grid_in._id,
+            "compression": self.compression,
+            "size": hashing_writer.size,
+            "stored_size": grid_in.length,
+            "created_at": datetime.utcnow(),
+        }
+        try:
+            self.blobs.insert_one(blob)
+        except DuplicateKeyError:
+            # Registered concurrently by another writer, keep theirs
+            self.fs.delete(grid_in._id)
+            blob = self.blobs.find_one({"_id": content_hash})
+        return blob
+
+    def _read_model_file(self, file_id, model_format: Optional[str], compression: Optional[str]):
+        """
+        Decompress and deserialize chunk by chunk while GridFS streams the file.
+        """
+        with self.fs.get(file_id) as grid_out:
+            return get_serializer(model_format).load(decompress_reader(grid_out, compression))
+
     def get_last_version(self, flag: str, model_name: str = None, experiment: Optional[str] = None) -> int:
         """
         Retrieve the latest version number of a model given its name and experiment.
         """
+        return self._cached(('last_version', flag, model_name, experiment),
+                            lambda: self._find_last_version(flag=flag, model_name=model_name, experiment=experiment))
+
+    def _find_last_version(self, flag: str, model_name: str = None, experiment: Optional[str] = None) -> int:
+        latest_version_document = self.collection.find_one(self._get_version_query(flag, model_name, experiment),
+                                                           {"version": 1, "_id": 0}, sort=[("version", -1)])
+
+        if not latest_version_document:
+            raise ModelNotFound(f"No versions found for model {model_name} under flag {flag}")
+
+        return latest_version_document.get('version')
+
+    def get_last_versions(self, models: List[Tuple[str, Optional[str], Optional[str]]]
+                          ) -> Dict[Tuple[str, Optional[str], Optional[str]], int]:
+        """
+        Latest version of each (flag, model_name, experiment) in a single aggregation, models without any version
+        are left out.
+        """
+        models = list(dict.fromkeys(models))
+        if not models:
+            return {}
+        queries = [self._get_version_query(flag, model_name, experiment) for flag, model_name, experiment in models]
+        pipeline = [
+            # Stages inside $facet can't use indexes, so the documents are narrowed and sorted on the indexed
+            # (flag, version) first and each facet only takes the first document of its model
+            {"$match": {"flag": {"$in": list(dict.fromkeys(flag for flag, _, _ in models))}, "$or": queries}},
+            {"$sort": {"flag": 1, "version": -1}},
+            {"$project": {"flag": 1, "name": 1, "experiments": 1, "version": 1, "_id": 0}},
+            {"$facet": {str(index): [{"$match": query}, {"$limit": 1}] for index, query in enumerate(queries)}},
+        ]
+        facets = next(self.collection.aggregate(pipeline), {})
+
+        last_versions = {}
+        for index, model in enumerate(models):
+            documents = facets.get(str(index))
+            if documents:
+                last_versions[model] = documents[0]['version']
+        return last_versions
+
+    @staticmethod
+    def _get_version_query(flag: str, model_name: Optional[str], experiment: Optional[str]) -> dict:
         query = {"flag": flag}
 
         if model_name:
@@ -96,23 +249,71 @@ class MongoDBModelRegistry(ModelRegistryInterface):
 
         if experiment:
             query["experiments"] = {"$in": [experiment]}
-
-        latest_version_document = self.collection.find_one(query, sort=[("version", -1)])
-
-        if not latest_version_document:
-            raise ModelNotFound(f"No versions found for model {model_name} under flag {flag}")
-
-        return latest_version_document.get('version')
+        return query
 
     def get_all_flag_models_specifications(self, flag: str) -> List[AiModel]:
         """
         Retrieve all the versions of a model given its names and a list of experiments, optionally including the creation date.
         """
-        documents = list(
-            self.collection.find({"flag": flag}, {"name": 1, "version": 1}).sort(
-                "version", 1))
+        documents = self._cached(('specifications', flag), lambda: list(
+            self.collection.find({"flag": flag}, {"name": 1, "version": 1, "_id": 0}).sort("version", 1)))
 
         if not documents:
             raise ModelNotFound(f"No versions found under flag {flag}")
 
         return [AiModel(name=doc["name"], version=doc["version"]) for doc in documents]
+
+    def watch_changes(self):
+        """
+        Invalidate cached metadata from a change stream on the collection (requires a replica set), without it
+        cached reads are at most metadata_cache_ttl seconds stale.
+        """
+        if self._change_stream is not None:
+            return
+        try:
+            self._change_stream = self.collection.watch(full_document='updateLookup')
+        except PyMongoError:
+            logger.exception("Change streams are not available, metadata is refreshed every %s seconds",
+                             self._metadata_cache.ttl)
+            return
+        threading.Thread(target=self._consume_changes, args=(self._change_stream,), daemon=True,
+                         name='model-registry-changes').start()
+
+    def stop_watching(self):
+        if self._change_stream is not None:
+            self._change_stream.close()
+            self._change_stream = None
+
+    def _consume_changes(self, change_stream):
+        try:
+            for change in change_stream:
+                flag = (change.get('fullDocument') or {}).get('flag')
+                if flag is None:
+                    # Deletes carry no document
+                    self._clear_metadata_cache()
+                else:
+                    self._invalidate_flag(flag)
+        except PyMongoError:
+            if change_stream.alive:
+                logger.exception("Model registry change stream stopped")
+        # Without a stream the TTL is the only freshness guarantee
+        self._clear_metadata_cache()
+
+    def _cached(self, key: Hashable, fetch: Callable[[], Any]):
+        with self._metadata_lock:
+            value = self._metadata_cache.get(key)
+        if value is None:
+            value = fetch()
+            if value:
+                with self._metadata_lock:
+                    self._metadata_cache[key] = value
+        return value
+
+    def _invalidate_flag(self, flag: str):
+        with self._metadata_lock:
+            for key in [key for key in self._metadata_cache if key[1] == flag]:
+                self._metadata_cache.pop(key, None)
+
+    def _clear_metadata_cache(self):
+        with self._metadata_lock:
+            self._metadata_cache.clear()
@@ -0,0 +1,167 @@
+import io
+import pickle
+from abc import ABC, abstractmethod
+from typing import BinaryIO, Dict, Optional, Union, Tuple, List, Any
+
+import joblib
+
+from src.registry.exception import ExperimentRegistryException
+
+
+class ModelSerializerInterface(ABC):
+    """
+    The format name is recorded next to every registered model, loads picks the serializer back from it.
+    """
+    format: str
+
+    @abstractmethod
+    def dumps(self, model) -> bytes:
+        pass
+
+    @abstractmethod
+    def loads(self, data: bytes):
+        pass
+
+    def dump(self, model, file: BinaryIO):
+        """
+        Serialize into a writable stream, formats that can stream override this to avoid the bytes copy.
+        """
+        file.write(self.dumps(model))
+
+    def load(self, file: BinaryIO):
+        return self.loads(file.read())
+
+
+class PickleSerializer(ModelSerializerInterface):
+    format = 'pickle'
+
+    def dumps(self, model) -> bytes:
+        return pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, data: bytes):
+        return pickle.loads(data)
+
+    def dump(self, model, file: BinaryIO):
+        pickle.dump(model, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def load(self, file: BinaryIO):
+        return pickle.load(file)
+
+
+class JoblibSerializer(ModelSerializerInterface):
+    """
+    joblib stores numpy arrays as raw buffers, compress is 0-9 or a (method, level) tuple e.g. ('lz4', 3).
+    """
+    format = 'joblib'
+
+    def __init__(self, compress: Union[int, Tuple[str, int]] = 3):
+        self.compress = compress
+
+    def dumps(self, model) -> bytes:
+        buffer = io.BytesIO()
+        joblib.dump(model, buffer, compress=self.compress)
+        return buffer.getvalue()
+
+    def loads(self, data: bytes):
+        return joblib.load(io.BytesIO(data))
+
+    def dump(self, model, file: BinaryIO):
+        joblib.dump(model, file, compress=self.compress)
+
+    def load(self, file: BinaryIO):
+        return joblib.load(file)
+
+
+class JoblibMmapSerializer(JoblibSerializer):
+    """
+    Uncompressed joblib, once written to a local file its numpy arrays can be memory-mapped with
+    joblib.load(path, mmap_mode='r').
+    """
+    format = 'joblib-mmap'
+
+    def __init__(self):
+        super().__init__(compress=0)
+
+
+class OnnxSerializer(ModelSerializerInterface):
+    """
+    Export sklearn models to ONNX, loads returns an onnxruntime.InferenceSession.
+    initial_types describes the model inputs e.g. [('input', FloatTensorType([None, 3]))].
+    """
+    format = 'onnx'
+
+    def __init__(self, initial_types: Optional[List[Tuple[str, Any]]] = None, target_opset: Optional[int] = None):
+        self.initial_types = initial_types
+        self.target_opset = target_opset
+
+    def dumps(self, model) -> bytes:
+        try:
+            from skl2onnx import convert_sklearn
+        except ImportError as ex:
+            raise ImportError("skl2onnx is required to export models to ONNX") from ex
+        if self.initial_types is None:
+            raise ExperimentRegistryException("initial_types is required to export a model to ONNX")
+        onnx_model = convert_sklearn(model, initial_types=self.initial_types, target_opset=self.target_opset)
+        return onnx_model.SerializeToString()
+
+    def loads(self, data: bytes):
+        try:
+            import onnxruntime
+        except ImportError as ex:
+            raise ImportError("onnxruntime is required to load ONNX models") from ex
+        return onnxruntime.InferenceSession(data, providers=['CPUExecutionProvider'])
+
+
+class SkopsSerializer(ModelSerializerInterface):
+    """
+    skops refuses to load types that are not trusted, pass the extra trusted type names if needed.
+    """
+    format = 'skops'
+
+    def __init__(self, trusted: Optional[List[str]] = None):
+        self.trusted = trusted
+
+    def dumps(self, model) -> bytes:
+        try:
+            import skops.io
+        except ImportError as ex:
+            raise ImportError("skops is required for the skops format") from ex
+        return skops.io.dumps(model)
+
+    def loads(self, data: bytes):
+        try:
+            import skops.io
+        except ImportError as ex:
+            raise ImportError("skops is required for the skops format") from ex
+        return skops.io.loads(data, trusted=self.trusted)
+
+
+DEFAULT_MODEL_FORMAT = PickleSerializer.format
+
+_SERIALIZERS: Dict[str, ModelSerializerInterface] = {
+    serializer.format: serializer for serializer in (
+        PickleSerializer(),
+        JoblibSerializer(),
+        JoblibMmapSerializer(),
+        OnnxSerializer(),
+        SkopsSerializer(),
+    )
+}
+
+
+def register_serializer(serializer: ModelSerializerInterface):
+    """
+    Make a serializer available to loads, e.g. a SkopsSerializer with extra trusted types.
+    """
+    _SERIALIZERS[serializer.format] = serializer
+
+
+def get_serializer(model_format: Optional[str]) -> ModelSerializerInterface:
+    """
+    Models registered before the format was recorded are pickles.
+    """
+    model_format = model_format or DEFAULT_MODEL_FORMAT
+    try:
+        return _SERIALIZERS[model_format]
+    except KeyError:
+        raise ExperimentRegistryException(f"Unknown model format {model_format}")
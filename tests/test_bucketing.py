@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.experiment.bucketing import Fnv1aBucketingEngine
+
+
+@pytest.fixture
+def engine():
+    return Fnv1aBucketingEngine()
+
+
+@pytest.mark.parametrize("layer_values", [
+    [1, 2.5, "a", None],
+    [True, False, 2],
+    [b"abc", "abc"],
+    [1.0, float("nan"), -0.0],
+    ["trailing\x00", "trailing", ""],
+    ["09123456789", "été"],
+    [2 ** 70, -5, 0],
+])
+def test_bucket_many_matches_bucket(engine, layer_values):
+    expected = [engine.bucket("flag", "layer", value) for value in layer_values]
+    assert engine.bucket_many("flag", "layer", layer_values).tolist() == expected
+
+
+@pytest.mark.parametrize("layer_values", [
+    np.arange(-5, 100),
+    np.array(["a", "bb", "été"]),
+    np.array([1.0, 2.5, np.nan]),
+    np.array([True, False]),
+    pd.Series([1, None]),
+    pd.Series(["09123456789", None]),
+])
+def test_bucket_many_matches_bucket_for_arrays(engine, layer_values):
+    expected = [engine.bucket("flag", "layer", value) for value in layer_values]
+    assert engine.bucket_many("flag", "layer", layer_values).tolist() == expected
+
+
+def test_bucket_many_empty(engine):
+    assert engine.bucket_many("flag", "layer", []).tolist() == []
@@ -0,0 +1,75 @@
+import asyncio
+
+import fakeredis
+import fakeredis.aioredis
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.experiment.async_experiment_manager import AsyncExperimentManager
+from src.experiment.async_redis_connector import AsyncRedisConnector
+from src.experiment.base import Experiment, Flag, ExperimentFlagType
+from src.experiment.experiment_manager import ExperimentManager
+from src.experiment.redis_connector import RedisConnector
+
+FLAG_NAME = "package-suggestion"
+LAYER = "phone-number"
+LAYER_VALUES = [
+    [f"0912{user:07d}" for user in range(500)],
+    list(range(500)),
+    [1, 2.5, True, b"abc", None, float("nan"), "trailing\x00", "été"],
+    np.arange(500),
+    pd.Series([f"0912{user:07d}" for user in range(200)]),
+]
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def experiment_manager(server, monkeypatch):
+    redis_client = fakeredis.FakeRedis(server=server)
+    # fakeredis doesn't support the persistence settings applied on initialise
+    monkeypatch.setattr(redis_client, "config_set", lambda *args, **kwargs: None)
+    RedisConnector.initialise(redis_client)
+    ExperimentManager.initialise(model_registry=None, redis_connector=RedisConnector, data_registry=None)
+    ExperimentManager._experiments_cache.clear()
+
+    RedisConnector.save_flag(Flag(FLAG_NAME, ExperimentFlagType.INTEGER, 0, None))
+    RedisConnector.save_many(experiments=[
+        Experiment("control", FLAG_NAME, 1, LAYER, None, 0.3),
+        Experiment("treatment", FLAG_NAME, 2, LAYER, None, 0.3),
+        Experiment("other-layer", FLAG_NAME, 3, "other", None, 0.5),
+    ])
+    return ExperimentManager
+
+
+@pytest.mark.parametrize("layer_values", LAYER_VALUES)
+def test_evaluate_many_matches_evaluate(experiment_manager, layer_values):
+    flag_values, experiment_names = experiment_manager.evaluate_many(FLAG_NAME, LAYER, layer_values)
+
+    expected = [experiment_manager.evaluate(FLAG_NAME, LAYER, value) for value in layer_values]
+    assert list(zip(flag_values.tolist(), experiment_names.tolist())) == expected
+
+
+def test_evaluate_many_assigns_every_experiment_of_the_layer(experiment_manager):
+    _, experiment_names = experiment_manager.evaluate_many(FLAG_NAME, LAYER, LAYER_VALUES[0])
+    assert set(experiment_names.tolist()) == {"control", "treatment", None}
+
+
+@pytest.mark.parametrize("layer_values", LAYER_VALUES)
+def test_async_evaluate_many_matches_evaluate(experiment_manager, server, layer_values):
+    async def evaluate():
+        AsyncRedisConnector.initialise(fakeredis.aioredis.FakeRedis(server=server))
+        AsyncExperimentManager.initialise(model_registry=None, redis_connector=AsyncRedisConnector)
+        AsyncExperimentManager._experiments_cache.clear()
+        many = await AsyncExperimentManager.evaluate_many(FLAG_NAME, LAYER, layer_values)
+        single = [await AsyncExperimentManager.evaluate(FLAG_NAME, LAYER, value) for value in layer_values]
+        return many, single
+
+    (flag_values, experiment_names), single = asyncio.run(evaluate())
+
+    assert list(zip(flag_values.tolist(), experiment_names.tolist())) == single
+    assert single == [experiment_manager.evaluate(FLAG_NAME, LAYER, value) for value in layer_values]
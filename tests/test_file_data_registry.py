@@ -0,0 +1,103 @@
+import os
+from datetime import date
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pytest
+
+from src.registry.data.file.connector import FileDataRegistry
+
+
+@pytest.fixture(params=[FileDataRegistry.PARQUET, FileDataRegistry.ARROW])
+def registry(tmp_path, request):
+    return FileDataRegistry(str(tmp_path), file_format=request.param)
+
+
+def test_publish_flush_round_trip(registry):
+    registry.publish({"user": 1, "score": 0.5}, data_name="clicks", experiment="a")
+    registry.publish('{"user": 2, "score": 1.5}', data_name="clicks", experiment="a")
+    registry.publish({"user": 3, "score": 2.5}, data_name="clicks", experiment="b")
+    assert registry.load("clicks", "a") == []
+
+    registry.flush()
+
+    records = registry.load("clicks", "a")
+    assert sorted((record["user"], record["score"]) for record in records) == [(1, 0.5), (2, 1.5)]
+    assert [record["user"] for record in registry.load("clicks", "b")] == [3]
+    assert registry.load("clicks", "c") == []
+
+
+def test_buffer_is_written_when_full(tmp_path):
+    registry = FileDataRegistry(str(tmp_path), max_buffered_rows=2)
+    registry.publish({"user": 1}, data_name="clicks", experiment="a")
+    assert registry.load("clicks", "a") == []
+    registry.publish({"user": 2}, data_name="clicks", experiment="a")
+    assert len(registry.load("clicks", "a")) == 2
+
+
+def test_date_pruning(registry):
+    for day in (1, 2, 3):
+        registry.publish({"day": day}, data_name="clicks", experiment="a", date=date(2024, 1, day))
+    registry.flush()
+
+    table = registry.load_arrow("clicks", "a", start_date="2024-01-02", end_date=date(2024, 1, 2))
+    assert table.column("day").to_pylist() == [2]
+    table = registry.load_arrow("clicks", "a", start_date=date(2024, 1, 2))
+    assert sorted(table.column("day").to_pylist()) == [2, 3]
+
+
+def test_column_projection(registry):
+    registry.publish({"user": 1, "score": 0.5, "country": "de"}, data_name="clicks", experiment="a")
+    registry.flush()
+
+    table = registry.load_arrow("clicks", "a", columns=["user", "score"])
+    assert table.column_names == ["user", "score"]
+
+
+def test_filter_pushdown(tmp_path):
+    registry = FileDataRegistry(str(tmp_path), row_group_size=10)
+    registry.publish_many([{"user": user} for user in range(100)], data_name="clicks", experiment="a")
+    registry.flush()
+
+    table = registry.load_arrow("clicks", "a", filter=ds.field("user") >= 95)
+    assert sorted(table.column("user").to_pylist()) == [95, 96, 97, 98, 99]
+    batches = list(registry.iter_load("clicks", "a", filter=ds.field("user") < 3))
+    assert sorted(record["user"] for batch in batches for record in batch) == [0, 1, 2]
+
+
+def test_schema_unification_across_files(registry):
+    registry.publish({"user": 1, "score": 1}, data_name="clicks", experiment="a")
+    registry.flush()
+    registry.publish({"user": 2, "score": 2.5, "country": "de"}, data_name="clicks", experiment="a")
+    registry.flush()
+
+    table = registry.load_arrow("clicks", "a")
+    assert table.schema.field("score").type == pa.float64()
+    assert table.schema.field("country").type == pa.string()
+    records = sorted(table.to_pylist(), key=lambda record: record["user"])
+    assert [(record["score"], record["country"]) for record in records] == [(1.0, None), (2.5, "de")]
+
+
+def test_explicit_schema(registry):
+    registry.publish({"user": 1, "score": 1}, data_name="clicks", experiment="a")
+    registry.flush()
+
+    schema = pa.schema([("user", pa.int32()), ("score", pa.float32())])
+    table = registry.load_arrow("clicks", "a", schema=schema, columns=["user", "score"])
+    assert table.schema == schema
+
+
+def test_failed_write_keeps_the_records(registry):
+    registry.publish({"user": 1}, data_name="clicks", experiment="a")
+    registry.publish("not json", data_name="clicks", experiment="b")
+
+    with pytest.raises(pa.ArrowInvalid):
+        registry.flush()
+    # The partitions not written are buffered again
+    assert len(registry._buffers[("clicks", "b", registry._get_date(None))]) == 1
+
+
+def test_experiment_without_finished_files(registry, tmp_path):
+    os.makedirs(os.path.join(registry._get_experiment_dir("clicks", "a"), "date=2024-01-01"))
+    assert registry.load("clicks", "a") == []
+    assert registry.load_arrow("clicks", "a").num_rows == 0
@@ -0,0 +1,38 @@
+import pyarrow as pa
+import pytest
+
+from src.registry.data.kafka.connector import KafkaRegistry
+
+
+def _encode(*records):
+    return [record.encode('utf-8') for record in records]
+
+
+def test_batch_schema_is_inferred_over_the_whole_batch():
+    # Past the reader's default 1 MB block, a column null so far then nested
+    batch = _encode(*['{"x": null}'] * 200000, '{"x": {"a": 1}}')
+    table = KafkaRegistry._decode_batch(batch, None)
+    assert table.schema.field('x').type == pa.struct([pa.field('a', pa.int64())])
+    assert table.num_rows == 200001
+
+
+def test_conflicting_types_in_a_batch_are_strings():
+    table = KafkaRegistry._decode_batch(_encode('{"x": 1, "y": 1}', '{"x": "a", "y": 2}', '{"x": null}'), None)
+    assert table.schema.field('x').type == pa.string()
+    assert table.column('x').to_pylist() == ['1', 'a', None]
+    assert table.column('y').to_pylist() == [1, 2, None]
+
+
+def test_conflicting_types_across_batches_are_strings():
+    tables = [KafkaRegistry._decode_batch(_encode('{"x": 1, "y": null, "z": {"a": 1}}'), None),
+              KafkaRegistry._decode_batch(_encode('{"x": "a", "y": 1.5, "z": "b"}'), None)]
+    table = KafkaRegistry._concat_tables(tables, None)
+    assert table.column('x').to_pylist() == ['1', 'a']
+    assert table.column('y').to_pylist() == [None, 1.5]
+    assert table.column('z').to_pylist() == ['{"a": 1}', 'b']
+
+
+def test_conflicting_types_with_a_schema_raise():
+    schema = pa.schema([pa.field('x', pa.int64())])
+    with pytest.raises(pa.ArrowInvalid):
+        KafkaRegistry._decode_batch(_encode('{"x": "a"}'), schema)
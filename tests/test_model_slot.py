@@ -0,0 +1,68 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pytest
+
+from src.registry.model.base import ExperimentModel, ModelSlot
+
+
+def _model(version):
+    return ExperimentModel(model=object(), model_name='model', version=version, experiment='experiment',
+                           flag='flag', updated_at=datetime.now())
+
+
+def _loader(version, release=None):
+    def load():
+        if release is not None:
+            assert release.wait(5)
+        return _model(version)
+    return load
+
+
+@pytest.fixture
+def executor():
+    executor = ThreadPoolExecutor(max_workers=2)
+    yield executor
+    executor.shutdown(wait=True)
+
+
+def test_slower_earlier_request_is_not_swapped_in(executor):
+    slot = ModelSlot('experiment')
+    release = threading.Event()
+    slow = slot.prefetch(1, _loader(1, release), executor)
+    slot.prefetch(2, _loader(2), executor).result(5)
+    release.set()
+    slow.result(5)
+    assert slot.current.version == 2
+
+
+def test_pinning_back_to_an_older_version(executor):
+    slot = ModelSlot('experiment')
+    release = threading.Event()
+    slow = slot.prefetch(2, _loader(2, release), executor)
+    slot.prefetch(1, _loader(1), executor).result(5)
+    release.set()
+    slow.result(5)
+    assert slot.current.version == 1
+
+
+def test_request_for_the_live_version_cancels_pending_swap(executor):
+    slot = ModelSlot('experiment')
+    slot.swap(_model(1))
+    release = threading.Event()
+    slow = slot.prefetch(2, _loader(2, release), executor)
+    assert slot.prefetch(1, _loader(1), executor) is None
+    release.set()
+    slow.result(5)
+    assert slot.current.version == 1
+
+
+def test_version_already_loading_is_not_loaded_twice(executor):
+    slot = ModelSlot('experiment')
+    release = threading.Event()
+    first = slot.prefetch(1, _loader(1, release), executor)
+    assert slot.prefetch(1, _loader(1), executor) is None
+    release.set()
+    first.result(5)
+    assert slot.current.version == 1